@@ -0,0 +1,105 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from api.utils import request_cache
+
+# Заголовки тела и условных запросов внешнего запроса подзапросам
+# не передаются.
+SKIPPED_META = (
+    'CONTENT_LENGTH',
+    'CONTENT_TYPE',
+    'HTTP_IF_NONE_MATCH',
+    'HTTP_IF_MODIFIED_SINCE',
+)
+
+
+def sub_request(request, path):
+    """GET-запрос к path от имени уже аутентифицированного пользователя"""
+    url = urlsplit(path)
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = url.path
+    sub.META = {
+        key: value for key, value in request.META.items()
+        if key not in SKIPPED_META
+    }
+    sub.META.update(
+        REQUEST_METHOD='GET', PATH_INFO=url.path, QUERY_STRING=url.query
+    )
+    sub.GET = QueryDict(url.query)
+    sub.COOKIES = request.COOKIES
+    if request.user.is_authenticated:
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+    sub.batch_cache = request_cache(request)
+    return sub
+
+
+def response_body(response):
+    data = getattr(response, 'data', None)
+    if data is not None:
+        return data
+    if response.streaming:
+        return None
+    # Response без данных (400 пустой корзины, 204) ещё не отрисован.
+    if not getattr(response, 'is_rendered', True):
+        response.render()
+    content = response.content
+    if not content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content)
+    return content.decode(response.charset)
+
+
+def dispatch(request, path):
+    """Выполнить подзапрос через обычный view и вернуть его результат"""
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        match = None
+    if match is None or match.url_name == 'batch':
+        return {'path': path, 'status': 404, 'body': {'detail': 'Not found.'}}
+    response = match.func(sub_request(request, path), *match.args,
+                          **match.kwargs)
+    return {
+        'path': path,
+        'status': response.status_code,
+        'body': response_body(response),
+    }
+
+
+def dispatch_in_thread(request, path):
+    """
+    Подзапрос в потоке пула. У потока свои соединения, поэтому на них
+    заново ставится срок внешнего запроса.
+    """
+    deadline = getattr(request, 'deadline', None)
+    try:
+        with ExitStack() as stack:
+            if deadline is not None:
+                deadline = deadline.fork()
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(deadline)
+                    )
+            return dispatch(request, path)
+    finally:
+        connections.close_all()
+
+
+def dispatch_all(request, paths, parallel=False):
+    """Ответы на подзапросы в том же порядке, что и paths"""
+    if not parallel or len(paths) < 2:
+        return [dispatch(request, path) for path in paths]
+    with ThreadPoolExecutor(settings.BATCH_WORKERS) as executor:
+        return list(executor.map(
+            lambda path: dispatch_in_thread(request, path), paths
+        ))
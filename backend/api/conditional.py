@@ -0,0 +1,63 @@
+from django.db.models import Exists, OuterRef
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscribe
+
+# Флаги пользователя, от которых зависит ответ с рецептом.
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart', 'is_subscribed')
+
+
+def recipe_validators(request, pk):
+    """
+    ETag и Last-Modified рецепта одним запросом по одной строке или None,
+    если рецепта нет. Флаги пользователя меняются без отметки времени,
+    поэтому Last-Modified отдаётся только гостям, а в ETag входят флаги.
+    """
+    if not str(pk).isdigit():
+        return None
+    queryset = Recipe.objects.filter(pk=pk)
+    fields = ['updated']
+    user = request.user
+    if user.is_authenticated:
+        queryset = queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )),
+            is_subscribed=Exists(Subscribe.objects.filter(
+                author=OuterRef('author'), user=user
+            )),
+        )
+        fields += USER_FLAGS
+    row = queryset.values_list(*fields).first()
+    if row is None:
+        return None
+    updated, *flags = row
+    version = f'{pk}-{updated.timestamp():.6f}'
+    if flags:
+        return f'"{version}-{"".join(str(int(flag)) for flag in flags)}"', None
+    return f'"{version}"', int(updated.timestamp())
+
+
+def not_modified(request, validators):
+    """Ответ 304, если у клиента та же версия рецепта, иначе None"""
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request._request, etag=etag, last_modified=last_modified
+    )
+    if response is not None:
+        set_validators(response, validators)
+    return response
+
+
+def set_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -0,0 +1,140 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Tag)
+from users.models import Subscribe
+
+User = get_user_model()
+
+DOCUMENT_SQL = """
+    json_build_object(
+        'id', r.id,
+        'tags', (
+            SELECT coalesce(json_agg(json_build_object(
+                'id', t.id,
+                'name', t.name,
+                'color', t.color,
+                'slug', t.slug
+            ) ORDER BY t.id), '[]')
+            FROM {recipe_tags} rt JOIN {tag} t ON t.id = rt.tag_id
+            WHERE rt.recipe_id = r.id
+        ),
+        'author', CASE WHEN u.id IS NULL THEN NULL ELSE json_build_object(
+            'email', u.email,
+            'id', u.id,
+            'username', u.username,
+            'first_name', u.first_name,
+            'last_name', u.last_name,
+            'is_subscribed', EXISTS(
+                SELECT 1 FROM {subscribe} s
+                WHERE s.author_id = u.id AND s.user_id = %(user)s
+            ),
+            'avatar', CASE WHEN coalesce(u.avatar, '') = '' THEN NULL
+                           ELSE %(media)s || u.avatar END
+        ) END,
+        'ingredients', (
+            SELECT coalesce(json_agg(json_build_object(
+                'id', i.id,
+                'name', i.name,
+                'measurement_unit', i.measurement_unit,
+                'amount', ir.amount
+            ) ORDER BY ir.id), '[]')
+            FROM {ingredient_in_recipe} ir
+            JOIN {ingredient} i ON i.id = ir.ingredient_id
+            WHERE ir.recipe_id = r.id
+        ),
+        'is_favorited', EXISTS(
+            SELECT 1 FROM {favorite} f
+            WHERE f.recipe_id = r.id AND f.user_id = %(user)s
+        ),
+        'is_in_shopping_cart', EXISTS(
+            SELECT 1 FROM {shopping_cart} c
+            WHERE c.recipe_id = r.id AND c.user_id = %(user)s
+        ),
+        'name', r.name,
+        'image', CASE WHEN coalesce(r.image, '') = '' THEN NULL
+                      ELSE %(media)s || r.image END,
+        'text', r.text,
+        'cooking_time', r.cooking_time
+    )
+"""
+
+DOCUMENTS_SQL = """
+    SELECT {select}
+    FROM unnest(%(ids)s::bigint[]) WITH ORDINALITY AS ids(id, ord)
+    JOIN {recipe} r ON r.id = ids.id
+    LEFT JOIN {user} u ON u.id = r.author_id
+"""
+LIST_SELECT = "coalesce(json_agg({document} ORDER BY ids.ord), '[]')::text"
+DETAIL_SELECT = "{document}::text"
+
+
+def database_documents_enabled():
+    """Собирать JSON рецептов в PostgreSQL, если так настроен сервер"""
+    return (settings.RECIPE_READ_ENGINE == 'database'
+            and connection.vendor == 'postgresql')
+
+
+def table_names():
+    return {
+        name: connection.ops.quote_name(model._meta.db_table)
+        for name, model in (
+            ('recipe', Recipe),
+            ('recipe_tags', Recipe.tags.through),
+            ('tag', Tag),
+            ('ingredient', Ingredient),
+            ('ingredient_in_recipe', IngredientInRecipe),
+            ('favorite', Favorite),
+            ('shopping_cart', ShoppingCart),
+            ('subscribe', Subscribe),
+            ('user', User),
+        )
+    }
+
+
+def build_sql(select):
+    tables = table_names()
+    document = DOCUMENT_SQL.format(**tables)
+    return DOCUMENTS_SQL.format(
+        select=select.format(document=document), **tables
+    )
+
+
+def fetch_document(select, ids, request):
+    media = Recipe._meta.get_field('image').storage.url('')
+    with connection.cursor() as cursor:
+        cursor.execute(build_sql(select), {
+            'ids': list(ids),
+            'user': request.user.pk,
+            'media': request.build_absolute_uri(media),
+        })
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0].encode()
+
+
+def recipe_documents(ids, request):
+    """JSON-массив рецептов в порядке ids, готовый для ответа"""
+    return fetch_document(LIST_SELECT, ids, request)
+
+
+def recipe_document(pk, request):
+    """JSON одного рецепта или None, если такого нет"""
+    return fetch_document(DETAIL_SELECT, [pk], request)
+
+
+def paginated_document(envelope, results):
+    """Вставить готовый JSON-массив в обёртку пагинации"""
+    envelope = dict(envelope)
+    envelope.pop('results', None)
+    head = json.dumps(
+        envelope, ensure_ascii=False, separators=(',', ':')
+    )[1:-1]
+    if head:
+        head += ','
+    return f'{{{head}"results":'.encode() + results + b'}'
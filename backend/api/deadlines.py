@@ -0,0 +1,126 @@
+import math
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections
+from rest_framework.exceptions import APIException
+
+from api import metrics
+
+# SQLSTATE query_canceled: запрос прерван по statement_timeout.
+QUERY_CANCELED = '57014'
+
+
+class DeadlineExceeded(APIException):
+    status_code = 503
+    default_detail = 'Запрос выполнялся слишком долго, повторите позже'
+    default_code = 'deadline_exceeded'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF переносит wait в заголовок Retry-After.
+        self.wait = settings.LOAD_SHED_RETRY_AFTER
+
+
+def budget_for(resolver_match):
+    """Бюджет времени представления в секундах, 0 — без ограничения"""
+    deadlines = settings.REQUEST_DEADLINES
+    for key in (resolver_match.view_name, resolver_match.namespace):
+        if key in deadlines:
+            return deadlines[key]
+    return settings.REQUEST_DEADLINE
+
+
+class TimeoutApplied:
+    """
+    Метка statement_timeout, поставленного внутри транзакции: ROLLBACK
+    отменяет SET, и тогда метка пропадает из on_commit соединения,
+    не сработав.
+    """
+
+    def __init__(self):
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+
+
+class Deadline:
+    """
+    Обёртка запросов к базе на время одного HTTP-запроса. Первый запрос
+    к каждой базе PostgreSQL ставит statement_timeout в остаток бюджета
+    (и снова, если транзакцию с этим SET откатили), а после срока новые
+    запросы к базе не выполняются.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.expires = None
+        self.view = None
+        self.applied = {}
+
+    def start(self, resolver_match):
+        budget = budget_for(resolver_match)
+        if budget:
+            self.view = resolver_match.view_name
+            self.expires = self.started + budget
+
+    def fork(self):
+        """Тот же срок для соединений другого потока (/api/batch/)"""
+        deadline = Deadline(self.started)
+        deadline.expires, deadline.view = self.expires, self.view
+        return deadline
+
+    def exceeded(self, reason):
+        # Ответ об ошибке и всё после него уже не ограничиваются.
+        self.expires = None
+        metrics.increment('request_deadline_exceeded_total',
+                          view=self.view, reason=reason)
+        return DeadlineExceeded()
+
+    def timeout_applied(self, connection):
+        applied = self.applied.get(connection.alias)
+        if not isinstance(applied, TimeoutApplied) or applied.committed:
+            return applied is not None
+        return any(func is applied for _, func in connection.run_on_commit)
+
+    def apply_timeout(self, connection, cursor, remaining):
+        cursor.execute('SET statement_timeout = %s',
+                       [math.ceil(remaining * 1000)])
+        if connection.in_atomic_block:
+            applied = TimeoutApplied()
+            connection.on_commit(applied)
+        else:
+            applied = True
+        self.applied[connection.alias] = applied
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.expires is None:
+            return execute(sql, params, many, context)
+        remaining = self.expires - time.monotonic()
+        if remaining <= 0:
+            raise self.exceeded('deadline')
+        connection = context['connection']
+        if (connection.vendor == 'postgresql'
+                and not self.timeout_applied(connection)):
+            self.apply_timeout(connection, context['cursor'].cursor,
+                               remaining)
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if getattr(error.__cause__, 'pgcode', None) != QUERY_CANCELED:
+                raise
+            raise self.exceeded('statement_timeout') from error
+
+    def reset(self):
+        """Вернуть statement_timeout соединениям, которые переживут запрос"""
+        for alias in self.applied:
+            connection = connections[alias]
+            if (connection.connection is None
+                    or not connection.settings_dict['CONN_MAX_AGE']):
+                continue
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+            except DatabaseError:
+                connection.close()
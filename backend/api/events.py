@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from functools import lru_cache
+from time import sleep
+from urllib.parse import parse_qs
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections, connection, connections
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from api import metrics
+from recipes.models import Recipe
+from users.models import Subscribe
+
+EVENTS_PATH = '/api/events/'
+NOTIFY_CHANNEL = 'recipe_events'
+# pg_notify принимает до 8000 байт, подписчики уходят пачками.
+NOTIFY_CHUNK = 500
+TICKET_SALT = 'api.events.ticket'
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroker:
+    """
+    Рассылка событий открытым потокам своего процесса. Каждому потоку
+    своя очередь ограниченной длины: если клиент не успевает читать,
+    очередь сбрасывается и клиент получает событие overflow.
+    """
+    # Доходят ли до потоков события, опубликованные другим процессом.
+    shared = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(settings.EVENT_QUEUE_SIZE)
+        stream = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.streams.setdefault(user_id, set()).add(stream)
+        return stream
+
+    def unsubscribe(self, user_id, stream):
+        with self.lock:
+            streams = self.streams.get(user_id, set())
+            streams.discard(stream)
+            if not streams:
+                self.streams.pop(user_id, None)
+
+    def deliver(self, user_ids, event):
+        with self.lock:
+            streams = [
+                stream
+                for user_id in user_ids
+                for stream in self.streams.get(user_id, ())
+            ]
+        for loop, queue in streams:
+            loop.call_soon_threadsafe(offer, queue, event)
+
+    def publish(self, user_ids, event):
+        self.deliver(user_ids, event)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Рассылка между процессами через LISTEN/NOTIFY: запись идёт в WSGI,
+    а потоки событий держит ASGI-процесс.
+    """
+    shared = True
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, user_ids, event):
+        with connection.cursor() as cursor:
+            for start in range(0, len(user_ids), NOTIFY_CHUNK):
+                cursor.execute('SELECT pg_notify(%s, %s)', [
+                    NOTIFY_CHANNEL,
+                    json.dumps({
+                        'users': user_ids[start:start + NOTIFY_CHUNK],
+                        'event': event,
+                    }),
+                ])
+
+    def subscribe(self, user_id):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self.listen, daemon=True
+                )
+                self.listener.start()
+        return super().subscribe(user_id)
+
+    def listen(self):
+        params = connections['default'].get_connection_params()
+        while True:
+            try:
+                listener = psycopg2.connect(**params)
+                listener.autocommit = True
+                listener.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                while True:
+                    select.select([listener], [], [], 5)
+                    listener.poll()
+                    while listener.notifies:
+                        message = json.loads(listener.notifies.pop(0).payload)
+                        self.deliver(message['users'], message['event'])
+            except psycopg2.Error:
+                metrics.increment('event_listener_errors_total')
+                sleep(1)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.EVENT_BROKER)()
+
+
+def check_broker():
+    """
+    Предупредить при старте ASGI-процесса, если рецепты создаёт другой
+    процесс (gunicorn), а брокер не доставляет его события.
+    """
+    if not settings.DEBUG and not get_broker().shared:
+        logger.warning(
+            'EVENT_BROKER=%s доставляет события только внутри процесса:'
+            ' рецепты, созданные через gunicorn, не попадут в поток'
+            ' /api/events/. Укажите api.events.PostgresBroker.',
+            settings.EVENT_BROKER,
+        )
+
+
+def offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        metrics.increment('event_overflows_total')
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({'type': 'overflow'})
+
+
+def recipe_event(recipe):
+    return {
+        'type': 'recipe',
+        'id': recipe.id,
+        'name': recipe.name,
+        'author': recipe.author_id,
+    }
+
+
+def publish_new_recipe(recipe):
+    """
+    Сообщить подписчикам автора о новом рецепте. Вызывается после
+    коммита, поэтому ошибка рассылки только считается: рецепт уже
+    сохранён, а пропущенное событие клиент получит по Last-Event-ID.
+    """
+    try:
+        user_ids = list(Subscribe.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('user_id', flat=True))
+        if user_ids:
+            get_broker().publish(user_ids, recipe_event(recipe))
+            metrics.increment('events_published_total', len(user_ids))
+    except Exception:
+        metrics.increment('event_publish_errors_total')
+
+
+def issue_ticket(user_id):
+    """Подписанный билет на открытие потока событий вместо токена в URL"""
+    return signing.dumps(user_id, salt=TICKET_SALT)
+
+
+def ticket_user(ticket):
+    try:
+        return signing.loads(ticket, salt=TICKET_SALT,
+                             max_age=settings.EVENT_TICKET_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def encode(event):
+    lines = []
+    if event['type'] == 'recipe':
+        lines.append(f'id: {event["id"]}')
+    lines.append(f'event: {event["type"]}')
+    lines.append(f'data: {json.dumps(event, ensure_ascii=False)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+@sync_to_async
+def authenticate(key, ticket, last_event_id):
+    """
+    Пользователь по токену из заголовка или билету из ?ticket=
+    и рецепты, пропущенные с last_event_id
+    """
+    close_old_connections()
+    try:
+        if key:
+            user_id = Token.objects.filter(key=key).values_list(
+                'user_id', flat=True
+            ).first()
+        else:
+            user_id = ticket_user(ticket)
+        missed = []
+        if user_id is not None and last_event_id.isdigit():
+            missed = [
+                recipe_event(recipe)
+                for recipe in Recipe.objects.filter(
+                    author__subscribing__user_id=user_id,
+                    id__gt=int(last_event_id),
+                ).only('id', 'name', 'author_id').order_by('id')[
+                    :settings.EVENT_QUEUE_SIZE
+                ]
+            ]
+        return user_id, missed
+    finally:
+        close_old_connections()
+
+
+def request_credentials(scope):
+    """
+    Токен из заголовка Authorization или билет из ?ticket=. EventSource
+    не умеет слать заголовки, а токен в URL попал бы в логи nginx,
+    поэтому браузер получает короткоживущий билет в /api/events-ticket/.
+    """
+    headers = dict(scope['headers'])
+    keyword, _, key = headers.get(b'authorization', b'').decode().partition(
+        ' '
+    )
+    if keyword == 'Token' and key:
+        return key, '', headers
+    query = parse_qs(scope['query_string'].decode())
+    return '', query.get('ticket', [''])[0], headers
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_application(scope, receive, send):
+    """Поток server-sent events о новых рецептах авторов из подписок"""
+    key, ticket, headers = request_credentials(scope)
+    user_id, missed = await authenticate(
+        key, ticket, headers.get(b'last-event-id', b'').decode()
+    )
+    if user_id is None:
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'{"detail":"Invalid token."}',
+        })
+        return
+    broker = get_broker()
+    stream = broker.subscribe(user_id)
+    _, queue = stream
+    metrics.increment('event_streams_opened_total')
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    getter = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b''.join(map(encode, missed)) + b'retry: 5000\n\n',
+            'more_body': True,
+        })
+        while not disconnected.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=settings.EVENT_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter in done:
+                body = encode(getter.result())
+            else:
+                getter.cancel()
+                body = b': ping\n\n'
+            if not disconnected.done():
+                await send({
+                    'type': 'http.response.body',
+                    'body': body,
+                    'more_body': True,
+                })
+    finally:
+        # Отмена приложения застаёт getter в asyncio.wait.
+        if getter is not None:
+            getter.cancel()
+        disconnected.cancel()
+        broker.unsubscribe(user_id, stream)
+        metrics.increment('event_streams_closed_total')
@@ -0,0 +1,67 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.http import QueryDict
+
+from api import metrics, registry
+from api.filters import RecipeFilter
+from recipes.models import Recipe, Tag
+
+# Фильтры пользователя: с ними счётчики у каждого свои.
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def facets_requested(request):
+    return 'tags' in request.query_params.getlist('facets')
+
+
+def facet_filters(request):
+    """
+    Фильтры списка, кроме тегов: выбранные теги объединяются через ИЛИ,
+    и у каждого тега показывается, сколько рецептов добавит его выбор.
+    """
+    names = set(RecipeFilter.base_filters) - {'tags', 'ordering'}
+    params = QueryDict(mutable=True)
+    for name in sorted(names & set(request.query_params)):
+        params.setlist(name, request.query_params.getlist(name))
+    return params
+
+
+def tag_counts(request, queryset):
+    params = facet_filters(request)
+    if not params:
+        # Без других фильтров хватает счётчиков у самих тегов.
+        metrics.increment('tag_facets_total', source='counters')
+        return dict(Tag.objects.values_list('id', 'recipes_count'))
+    user = request.user.pk if set(params) & set(USER_FILTERS) else None
+    key = 'tag-facets:' + hashlib.blake2b(
+        f'{user}:{params.urlencode()}'.encode()
+    ).hexdigest()
+    counts = cache.get(key)
+    if counts is not None:
+        metrics.increment('tag_facets_total', source='cache')
+        return counts
+    filtered = RecipeFilter(params, queryset=queryset, request=request).qs
+    counts = dict(
+        Recipe.tags.through.objects.filter(
+            recipe_id__in=filtered.values('id')
+        ).values('tag_id').annotate(count=Count('id')).order_by().values_list(
+            'tag_id', 'count'
+        )
+    )
+    cache.set(key, counts, settings.FACET_CACHE_TIMEOUT)
+    metrics.increment('tag_facets_total', source='query')
+    return counts
+
+
+def tag_facets(request, queryset):
+    """Число рецептов по каждому тегу для текущих фильтров списка"""
+    counts = tag_counts(request, queryset)
+    tags = registry.records('tags', counts)
+    return [
+        {'id': tag.id, 'name': tag.name, 'slug': tag.slug,
+         'count': counts.get(tag.id, 0)}
+        for tag in sorted(tags.values(), key=lambda tag: tag.name)
+    ]
@@ -0,0 +1,139 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+
+from api import registry
+from api.utils import request_cache
+from api.view_counts import views_requested
+from recipes.models import IngredientInRecipe, Recipe
+from users.models import Subscribe
+
+User = get_user_model()
+
+RECIPE_VALUES = (
+    'id',
+    'name',
+    'image',
+    'text',
+    'cooking_time',
+    'views',
+    'is_favorited',
+    'is_in_shopping_cart',
+    'author_id',
+    'author__email',
+    'author__username',
+    'author__first_name',
+    'author__last_name',
+    'author__avatar',
+)
+
+
+def file_url(request, storage, name):
+    """Ссылка на файл так же, как её отдаёт ImageField из DRF"""
+    if not name:
+        return None
+    url = storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def recipe_values(queryset):
+    """Строки рецептов для быстрого чтения вместо объектов модели"""
+    return queryset.prefetch_related(None).values(*RECIPE_VALUES)
+
+
+def recipe_tags(recipe_ids):
+    tags = defaultdict(list)
+    rows = list(Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('tag_id').values_list('recipe_id', 'tag_id'))
+    records = registry.records('tags', {tag_id for _, tag_id in rows})
+    for recipe_id, tag_id in rows:
+        tag = records.get(tag_id)
+        if tag is not None:
+            tags[recipe_id].append(tag._asdict())
+    return tags
+
+
+def recipe_ingredients(recipe_ids):
+    ingredients = defaultdict(list)
+    rows = list(IngredientInRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list('recipe_id', 'ingredient_id', 'amount'))
+    records = registry.records(
+        'ingredients', {ingredient_id for _, ingredient_id, _ in rows}
+    )
+    for recipe_id, ingredient_id, amount in rows:
+        ingredient = records.get(ingredient_id)
+        if ingredient is None:
+            continue
+        ingredients[recipe_id].append({
+            'id': ingredient_id,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def subscribed_authors(user, author_ids):
+    if not user.is_authenticated or not author_ids:
+        return set()
+    return set(Subscribe.objects.filter(
+        user=user, author_id__in=author_ids
+    ).values_list('author_id', flat=True))
+
+
+def represent_recipes(rows, request):
+    """
+    Тот же JSON, что и у RecipeReadSerializer(many=True), собранный
+    из строк recipe_values() за три запроса на страницу.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    recipe_ids = [row['id'] for row in rows]
+    tags = recipe_tags(recipe_ids)
+    ingredients = recipe_ingredients(recipe_ids)
+    author_ids = {
+        row['author_id'] for row in rows if row['author_id'] is not None
+    }
+    subscribed = subscribed_authors(request.user, author_ids)
+    cache = request_cache(request)
+    for author_id in author_ids:
+        cache[('is_subscribed', author_id)] = author_id in subscribed
+    image_storage = Recipe._meta.get_field('image').storage
+    avatar_storage = User._meta.get_field('avatar').storage
+    with_views = views_requested(request)
+    data = []
+    for row in rows:
+        author_id = row['author_id']
+        author = None
+        if author_id is not None:
+            author = {
+                'email': row['author__email'],
+                'id': author_id,
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+                'is_subscribed': author_id in subscribed,
+                'avatar': file_url(request, avatar_storage,
+                                   row['author__avatar']),
+            }
+        recipe = {
+            'id': row['id'],
+            'tags': tags[row['id']],
+            'author': author,
+            'ingredients': ingredients[row['id']],
+            'is_favorited': bool(row['is_favorited']),
+            'is_in_shopping_cart': bool(row['is_in_shopping_cart']),
+            'name': row['name'],
+            'image': file_url(request, image_storage, row['image']),
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+        }
+        if with_views:
+            recipe['views'] = row['views']
+        data.append(recipe)
+    return data
@@ -26,13 +26,23 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    # Для синхронизации: рецепты, изменённые с этого момента.
+    updated_since = filters.IsoDateTimeFilter(
+        field_name='updated', lookup_expr='gte'
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('trending', 'Популярные'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags',
                   'author',
                   'is_favorited',
-                  'is_in_shopping_cart')
+                  'is_in_shopping_cart',
+                  'updated_since',
+                  'ordering')
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -47,3 +57,7 @@ class RecipeFilter(FilterSet):
                 recipes_shoppingcart_related__user=self.request.user
             )
         return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        # Порядок совпадает с индексом recipe_trending_idx.
+        return queryset.order_by('-trending', '-id')
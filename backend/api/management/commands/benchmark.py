@@ -0,0 +1,111 @@
+import json
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.db_serializers import recipe_documents
+from api.fast_serializers import recipe_values, represent_recipes
+from api.serializers import RecipeReadSerializer
+from api.views import RecipeViewSet
+
+User = get_user_model()
+
+
+def drf_serializer(queryset, request):
+    return JSONRenderer().render(RecipeReadSerializer(
+        queryset, many=True, context={'request': request}
+    ).data)
+
+
+def fast_serializer(queryset, request):
+    return JSONRenderer().render(
+        represent_recipes(recipe_values(queryset), request)
+    )
+
+
+def database_serializer(queryset, request):
+    return recipe_documents(queryset.values_list('id', flat=True), request)
+
+
+ENGINES = {
+    'serializer': drf_serializer,
+    'fast': fast_serializer,
+}
+POSTGRESQL_ENGINES = {
+    'database': database_serializer,
+}
+
+
+class Command(BaseCommand):
+    help = "Сравнить скорость и результат сериализации списка рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--recipes",
+            type=int,
+            default=100,
+            help="Количество рецептов в выборке",
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            type=int,
+            default=20,
+            help="Количество повторов для каждого способа",
+        )
+        parser.add_argument(
+            "-u",
+            "--user",
+            type=str,
+            help="Email пользователя, от имени которого идёт запрос",
+        )
+
+    def get_request(self, email):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        if email is None:
+            request.user = AnonymousUser()
+            return request
+        try:
+            request.user = User.objects.get(email=email)
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {email} не найден")
+        return request
+
+    def handle(self, *args, **kwargs):
+        request = self.get_request(kwargs["user"])
+        view = RecipeViewSet(request=request, action='list', format_kwarg=None)
+        queryset = view.get_queryset()[:kwargs["recipes"]]
+        count = queryset.count()
+        if not count:
+            raise CommandError("В базе нет рецептов")
+
+        engines = dict(ENGINES)
+        if connection.vendor == 'postgresql':
+            engines.update(POSTGRESQL_ENGINES)
+        reference = None
+        for name, engine in engines.items():
+            body = engine(queryset, request)
+            data = json.loads(body)
+            if reference is None:
+                reference = data
+            elif data != reference:
+                raise CommandError(
+                    f"Ответ {name} отличается от ответа serializer"
+                )
+            started = perf_counter()
+            for _ in range(kwargs["repeat"]):
+                engine(queryset, request)
+            elapsed = (perf_counter() - started) / kwargs["repeat"]
+            self.stdout.write(
+                f"{name}: {elapsed * 1000:.2f} мс на {count} рецептов, "
+                f"{elapsed * 1000 * 100 / count:.2f} мс на 100 рецептов, "
+                f"{len(body)} байт"
+            )
+        self.stdout.write(self.style.SUCCESS("Ответы совпадают"))
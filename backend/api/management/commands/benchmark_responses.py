@@ -0,0 +1,73 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.urls import resolve
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.middleware import COMPRESSORS
+from api.renderers import FastJSONRenderer
+
+RENDERERS = {
+    'json': JSONRenderer,
+    'fast': FastJSONRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = "Замерить кодирование и сжатие ответов API"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-p",
+            "--paths",
+            nargs="+",
+            type=str,
+            default=[
+                "/api/ingredients/",
+                "/api/tags/",
+                "/api/recipes/",
+                "/api/users/",
+            ],
+            help="Адреса для замера",
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            type=int,
+            default=20,
+            help="Количество повторов для каждого способа",
+        )
+
+    def measure(self, function, repeat):
+        started = perf_counter()
+        for _ in range(repeat):
+            result = function()
+        return result, (perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **kwargs):
+        factory = APIRequestFactory()
+        repeat = kwargs["repeat"]
+        for path in kwargs["paths"]:
+            match = resolve(path)
+            response = match.func(factory.get(path), *match.args,
+                                  **match.kwargs)
+            self.stdout.write(self.style.WARNING(path))
+            if hasattr(response, 'data'):
+                for name, renderer in RENDERERS.items():
+                    content, elapsed = self.measure(
+                        lambda: renderer().render(response.data), repeat
+                    )
+                    self.stdout.write(
+                        f"  {name}: {elapsed:.3f} мс, {len(content)} байт"
+                    )
+            else:
+                content = response.content
+            for encoding, compress in COMPRESSORS.items():
+                compressed, elapsed = self.measure(
+                    lambda: compress(content), repeat
+                )
+                self.stdout.write(
+                    f"  {encoding}: {elapsed:.3f} мс, {len(compressed)} байт, "
+                    f"экономия {len(content) - len(compressed)} байт"
+                )
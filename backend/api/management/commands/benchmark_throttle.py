@@ -0,0 +1,48 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.throttling import CacheSlidingWindow, LocalTokenBuckets
+
+
+class Command(BaseCommand):
+    help = "Замерить время решения ограничителя частоты запросов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--requests",
+            type=int,
+            default=100000,
+            help="Количество решений для замера",
+        )
+        parser.add_argument(
+            "-k",
+            "--keys",
+            type=int,
+            default=1000,
+            help="Количество разных пользователей",
+        )
+
+    def handle(self, *args, **kwargs):
+        stores = {
+            'local': LocalTokenBuckets(settings.THROTTLE_MAX_KEYS),
+            'cache': CacheSlidingWindow(
+                settings.THROTTLE_CACHE or 'default'
+            ),
+        }
+        total, keys = kwargs["requests"], kwargs["keys"]
+        for name, store in stores.items():
+            allowed = 0
+            started = perf_counter()
+            for number in range(total):
+                allowed += store.take(
+                    f'throttle:benchmark:{number % keys}', 60, 1.0,
+                    started + number / total
+                )[0]
+            elapsed = perf_counter() - started
+            self.stdout.write(
+                f"{name}: {elapsed / total * 1e6:.2f} мкс на решение, "
+                f"пропущено {allowed} из {total}"
+            )
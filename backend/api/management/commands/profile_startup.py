@@ -0,0 +1,141 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Выполняется в отдельном интерпретаторе, чтобы модули грузились с нуля.
+STARTUP_SCRIPT = """
+import json
+import os
+import resource
+import sys
+import tracemalloc
+from time import perf_counter
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+if os.environ.get('PROFILE_ALLOCATIONS'):
+    tracemalloc.start()
+stages = [('interpreter', 0.0, rss())]
+started = perf_counter()
+
+def stage(name):
+    stages.append((name, perf_counter() - started, rss()))
+
+import django
+django.setup()
+stage('django.setup')
+from django.urls import get_resolver
+get_resolver().url_patterns
+stage('urlconf')
+from django.conf import settings
+from django.utils.module_loading import import_string
+import_string(settings.WSGI_APPLICATION)
+stage('wsgi')
+
+allocated = {}
+if tracemalloc.is_tracing():
+    for stat in tracemalloc.take_snapshot().statistics('filename'):
+        filename = stat.traceback[0].filename
+        allocated[filename] = allocated.get(filename, 0) + stat.size
+print(json.dumps({
+    'stages': stages,
+    'allocated': allocated,
+    'path': sys.path,
+    'modules': sorted(
+        name for name, module in sys.modules.items() if module is not None
+    ),
+}))
+"""
+
+
+def package_of(filename, paths):
+    """Верхний пакет, к которому относится файл"""
+    roots = [path.rstrip(os.sep) + os.sep for path in paths if path]
+    matching = [root for root in roots if filename.startswith(root)]
+    if not matching:
+        return '<other>'
+    relative = filename[len(max(matching, key=len)):]
+    return relative.split(os.sep)[0].split('.')[0]
+
+
+def import_times(stderr):
+    """Собственное время импорта модулей по пакетам, в мкс"""
+    times = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        if not self_time.strip().isdigit():
+            continue
+        times[name.strip().split('.')[0]] += int(self_time)
+    return times
+
+
+class Command(BaseCommand):
+    help = "Замерить время запуска и память воркера по пакетам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-t",
+            "--top",
+            type=int,
+            default=15,
+            help="Сколько самых тяжёлых пакетов показать",
+        )
+        parser.add_argument(
+            "-m",
+            "--modules",
+            nargs="*",
+            default=["PIL", "coreapi", "social_core", "social_django"],
+            help="Проверить, загружены ли модули после запуска",
+        )
+        parser.add_argument(
+            "-a",
+            "--allocations",
+            action="store_true",
+            help="Считать память по пакетам через tracemalloc (медленно)",
+        )
+
+    def handle(self, *args, **kwargs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            capture_output=True,
+            text=True,
+            env={
+                **os.environ,
+                "PROFILE_ALLOCATIONS": "1" if kwargs["allocations"] else "",
+            },
+        )
+        if result.returncode:
+            raise CommandError(result.stderr[-2000:])
+        report = json.loads(result.stdout.splitlines()[-1])
+        times = import_times(result.stderr)
+        allocated = defaultdict(int)
+        for filename, size in report["allocated"].items():
+            allocated[package_of(filename, report["path"])] += size
+
+        for name, elapsed, rss in report["stages"]:
+            self.stdout.write(
+                f"{name:<14} {elapsed * 1000:8.1f} мс"
+                f" {rss / 2 ** 20:8.1f} МиБ RSS"
+            )
+        self.stdout.write(
+            f"импорт всего {sum(times.values()) / 1000:.1f} мс,"
+            f" модулей {len(report['modules'])}"
+        )
+        heaviest = sorted(times, key=times.get, reverse=True)
+        for name in heaviest[:kwargs["top"]]:
+            self.stdout.write(
+                f"  {name:<24} {times[name] / 1000:8.1f} мс"
+                f" {allocated.get(name, 0) / 2 ** 10:8.0f} КиБ"
+            )
+        loaded = set(report["modules"])
+        for name in kwargs["modules"]:
+            state = "загружен" if name in loaded else "не загружен"
+            self.stdout.write(f"{name}: {state}")
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.trending import refresh
+
+
+class Command(BaseCommand):
+    help = "Пересчитать популярность рецептов по новым событиям"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Посчитать популярность заново по всем событиям",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help=(
+                "Повторять каждые TRENDING_REFRESH_INTERVAL секунд"
+                " и не завершаться"
+            ),
+        )
+
+    def handle(self, *args, **kwargs):
+        updated = refresh(rebuild=kwargs["rebuild"])
+        self.stdout.write(f"Обновлено рецептов: {updated}")
+        while kwargs["loop"]:
+            time.sleep(settings.TRENDING_REFRESH_INTERVAL)
+            refresh()
@@ -0,0 +1,473 @@
+import json
+import random
+import re
+import threading
+import traceback
+from collections import Counter, defaultdict
+from http import HTTPStatus
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from time import perf_counter, sleep
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+User = get_user_model()
+
+COLLECTION = (
+    settings.BASE_DIR.parent / 'postman_collection'
+    / 'foodgram.postman_collection.json'
+)
+# Переменные коллекции, которые у каждого виртуального пользователя
+# и на каждой итерации свои, чтобы регистрации не пересекались.
+VARY = (
+    'email', 'username',
+    'secondUserEmail', 'secondUserUsername',
+    'thirdUserEmail', 'thirdUserUsername',
+)
+TAG_PATTERN = r'-lt\d+x\d+'
+
+VARIABLE = re.compile(r'\{\{([^{}]+)\}\}')
+EXPECTED_STATUS = re.compile(
+    r'pm\.response\.(?:status|code)\s*,[^)]*\)\s*'
+    r'\.to\.be\.eql\(\s*"?([^")]+)"?\s*\)'
+)
+GET_ALIAS = re.compile(
+    r'const\s+(\w+)\s*=\s*_\.get\(\s*responseData\s*,\s*'
+    r'["\']([\w.\[\]]+)["\']\s*\)'
+)
+SET_VARIABLE = re.compile(
+    r'pm\.collectionVariables\.set\(\s*["\'](\w+)["\']\s*,\s*'
+    r'([^;\n]+?)\)\s*;?\s*$',
+    re.M,
+)
+EXPRESSION = re.compile(
+    r'^responseData((?:\[\d+\]|\.\w+)*?)'
+    r'(?:\.slice\((\d+),\s*(\d+)\))?$'
+)
+PATH_STEP = re.compile(r'\[(\d+)\]|\.(\w+)')
+
+STATUS_CODES = {status.phrase: status.value for status in HTTPStatus}
+# Символы, которые в пути и строке запроса остаются как есть; «%» —
+# чтобы не кодировать уже закодированное в коллекции.
+PATH_SAFE = "/%:@!$&'()*+,;="
+QUERY_SAFE = PATH_SAFE + '?'
+
+
+def parse_path(path):
+    return [
+        int(index) if index else key
+        for index, key in PATH_STEP.findall(path)
+    ]
+
+
+def parse_captures(script):
+    """Какие переменные тест Postman берёт из ответа и откуда"""
+    aliases = {
+        name: '.' + path for name, path in GET_ALIAS.findall(script)
+    }
+    captures = []
+    for name, expression in SET_VARIABLE.findall(script):
+        expression = aliases.get(expression.strip(), expression.strip())
+        if expression.startswith('.'):
+            expression = 'responseData' + expression
+        match = EXPRESSION.match(expression)
+        if match is None:
+            continue
+        path, start, stop = match.groups()
+        cut = (int(start), int(stop)) if start else None
+        captures.append((name, parse_path(path), cut))
+    return captures
+
+
+def parse_expected(script):
+    match = EXPECTED_STATUS.search(script)
+    if match is None:
+        return None
+    value = match[1].strip()
+    return int(value) if value.isdigit() else STATUS_CODES.get(value)
+
+
+def collect_steps(items, auth=None, folder=''):
+    """Запросы коллекции по порядку, с унаследованной авторизацией"""
+    for item in items:
+        item_auth = item.get('auth', auth)
+        if 'item' in item:
+            yield from collect_steps(item['item'], item_auth, item['name'])
+            continue
+        request = item['request']
+        script = '\n'.join(
+            line
+            for event in item.get('event', [])
+            if event['listen'] == 'test'
+            for line in event['script']['exec']
+        )
+        url = request['url']
+        yield {
+            'name': f'{folder}/{item["name"]}',
+            'method': request['method'],
+            'url': url['raw'] if isinstance(url, dict) else url,
+            'headers': {
+                header['key']: header['value']
+                for header in request.get('header', [])
+                if not header.get('disabled')
+            },
+            'auth': request.get('auth', item_auth),
+            'body': request.get('body', {}).get('raw'),
+            'expected': parse_expected(script),
+            'captures': parse_captures(script),
+        }
+
+
+def render(text, variables):
+    return VARIABLE.sub(
+        lambda match: str(variables.get(match[1], match[0])), text
+    )
+
+
+def auth_headers(auth, variables):
+    if not auth:
+        return {}
+    entries = {
+        entry['key']: entry['value'] for entry in auth.get(auth['type'], [])
+    }
+    if auth['type'] == 'apikey' and entries.get('in', 'header') == 'header':
+        return {entries['key']: render(entries['value'], variables)}
+    if auth['type'] == 'bearer':
+        token = render(entries['token'], variables)
+        return {'Authorization': f'Bearer {token}'}
+    return {}
+
+
+def tagged(value, tag):
+    """Сделать логин или почту уникальными: vasya -> vasya-lt1x0"""
+    if '@' in value:
+        return value.replace('@', f'-{tag}@', 1)
+    if value.endswith('"'):
+        return f'{value[:-1]}-{tag}"'
+    return f'{value}-{tag}'
+
+
+def extract(data, path, cut):
+    try:
+        for step in path:
+            data = data[step]
+    except (KeyError, IndexError, TypeError):
+        return None
+    if cut is not None and isinstance(data, str):
+        data = data[cut[0]:cut[1]]
+    return data
+
+
+def request_target(url):
+    """Путь и строка запроса в ASCII, как их ждёт http.client"""
+    target = quote(url.path or '/', safe=PATH_SAFE)
+    if url.query:
+        target += '?' + quote(url.query, safe=QUERY_SAFE)
+    return target
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class VirtualUser:
+    """Один пользователь нагрузки: свои переменные и соединения"""
+
+    def __init__(self, number, steps, variables, options):
+        self.number = number
+        self.steps = steps
+        self.variables = variables
+        self.options = options
+        self.connections = {}
+        self.results = []
+        self.crash = None
+
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key not in self.connections:
+            connection_class = (
+                HTTPSConnection if scheme == 'https' else HTTPConnection
+            )
+            self.connections[key] = connection_class(
+                netloc, timeout=self.options['timeout']
+            )
+        return self.connections[key]
+
+    def send(self, step, variables):
+        url = urlsplit(render(step['url'], variables))
+        target = request_target(url)
+        headers = {
+            key: render(value, variables)
+            for key, value in step['headers'].items()
+        }
+        headers.update(auth_headers(step['auth'], variables))
+        body = None
+        if step['body'] is not None:
+            body = render(step['body'], variables).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        connection = self.connection(url.scheme, url.netloc)
+        try:
+            connection.request(step['method'], target, body, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, HTTPException):
+            self.drop_connection(url)
+            return None, b''
+        except Exception:
+            self.drop_connection(url)
+            raise
+
+    def drop_connection(self, url):
+        connection = self.connections.pop((url.scheme, url.netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def iterate(self, iteration, deadline):
+        variables = dict(self.variables)
+        if self.options['vary']:
+            tag = f'lt{self.number}x{iteration}'
+            for name in self.options['vary']:
+                if name in variables:
+                    variables[name] = tagged(variables[name], tag)
+        for step in self.steps:
+            if deadline and perf_counter() > deadline:
+                return False
+            started = perf_counter()
+            try:
+                status, payload = self.send(step, variables)
+            except Exception as error:
+                # Ошибка шага — неудачный запрос, а не конец пользователя.
+                elapsed = perf_counter() - started
+                self.results.append((
+                    step['name'], elapsed, False,
+                    f'{type(error).__name__}: {error}',
+                ))
+                continue
+            elapsed = perf_counter() - started
+            if step['expected']:
+                ok = status == step['expected']
+            else:
+                ok = status is not None and status < 500
+            self.results.append((step['name'], elapsed, ok, status))
+            if status is not None and step['captures']:
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    data = None
+                for name, path, cut in step['captures']:
+                    value = extract(data, path, cut)
+                    if value is not None:
+                        variables[name] = value
+            if self.options['think']:
+                sleep(random.uniform(0, 2 * self.options['think']))
+        return True
+
+    def run(self, delay, deadline):
+        sleep(delay)
+        iteration = 0
+        try:
+            while not self.options['iterations'] or (
+                iteration < self.options['iterations']
+            ):
+                if not self.iterate(iteration, deadline):
+                    break
+                iteration += 1
+        except Exception:
+            self.crash = traceback.format_exc()
+        finally:
+            for connection in self.connections.values():
+                connection.close()
+
+
+class Command(BaseCommand):
+    help = "Прогнать postman-коллекцию как проверку или нагрузочный тест"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--collection",
+            default=str(COLLECTION),
+            help="Путь к файлу postman-коллекции",
+        )
+        parser.add_argument(
+            "-b",
+            "--base-url",
+            help="Адрес сервера вместо переменной baseUrl коллекции",
+        )
+        parser.add_argument(
+            "-u",
+            "--users",
+            type=int,
+            default=1,
+            help="Количество виртуальных пользователей",
+        )
+        parser.add_argument(
+            "-i",
+            "--iterations",
+            type=int,
+            default=1,
+            help="Прогонов коллекции на пользователя, 0 — без ограничения",
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            type=float,
+            default=0,
+            help="Ограничить прогон секундами, 0 — без ограничения",
+        )
+        parser.add_argument(
+            "--ramp-up",
+            type=float,
+            default=0,
+            help="За сколько секунд запустить всех пользователей",
+        )
+        parser.add_argument(
+            "--think",
+            type=float,
+            default=0,
+            help="Средняя пауза между запросами в секундах",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30,
+            help="Таймаут запроса в секундах",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Удалить пользователей коллекции перед прогоном",
+        )
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="Завершиться с ошибкой, если хоть один запрос не прошёл",
+        )
+
+    def handle(self, *args, **kwargs):
+        if not kwargs["iterations"] and not kwargs["duration"]:
+            raise CommandError("Укажите --iterations или --duration")
+        try:
+            with open(kwargs["collection"], encoding="utf-8") as file:
+                collection = json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Коллекция не прочитана: {error}")
+        variables = {
+            variable["key"]: variable["value"]
+            for variable in collection.get("variable", [])
+        }
+        if kwargs["base_url"]:
+            variables["baseUrl"] = kwargs["base_url"].rstrip("/")
+        steps = list(collect_steps(collection["item"], collection.get("auth")))
+        if kwargs["reset"]:
+            self.reset(steps, variables)
+
+        options = {
+            "iterations": kwargs["iterations"],
+            "think": kwargs["think"],
+            "timeout": kwargs["timeout"],
+            "vary": VARY if kwargs["users"] > 1 or (
+                kwargs["iterations"] != 1
+            ) else (),
+        }
+        users = [
+            VirtualUser(number, steps, variables, options)
+            for number in range(kwargs["users"])
+        ]
+        started = perf_counter()
+        deadline = started + kwargs["duration"] if kwargs["duration"] else 0
+        threads = [
+            threading.Thread(target=user.run, args=(
+                kwargs["ramp_up"] * number / len(users), deadline
+            ))
+            for number, user in enumerate(users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - started
+        errors, missed = self.report(steps, users, elapsed)
+        crashed = sum(user.crash is not None for user in users)
+        if kwargs["strict"] and (errors or missed or crashed):
+            raise CommandError(
+                f"Не прошло запросов: {errors}, не выполнено шагов: {missed},"
+                f" остановилось пользователей: {crashed}"
+            )
+
+    def reset(self, steps, variables):
+        """То же, что clear_db.sh, плюс логины нагрузочных прогонов"""
+        usernames = set()
+        for step in steps:
+            if step["method"] != "POST" or step["body"] is None:
+                continue
+            if not render(step["url"], variables).endswith("/api/users/"):
+                continue
+            try:
+                body = json.loads(render(step["body"], variables))
+            except ValueError:
+                continue
+            if isinstance(body, dict) and isinstance(
+                body.get("username"), str
+            ):
+                usernames.add(body["username"])
+        names = "|".join(re.escape(name) for name in usernames)
+        deleted, _ = User.objects.filter(
+            username__regex=rf"^({names})({TAG_PATTERN})?$"
+        ).delete()
+        self.stdout.write(self.style.WARNING(
+            f"Удалено объектов прошлых прогонов: {deleted}"
+        ))
+
+    def report(self, steps, users, elapsed):
+        latencies = defaultdict(list)
+        failures = defaultdict(Counter)
+        for user in users:
+            for name, latency, ok, status in user.results:
+                latencies[name].append(latency)
+                if not ok:
+                    failures[name][status] += 1
+        expected = {step["name"]: step["expected"] for step in steps}
+        self.stdout.write(
+            f"{'запрос':<60} {'всего':>6} {'ошибок':>6}"
+            f" {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}"
+        )
+        total = errors = 0
+        missed = []
+        for name in dict.fromkeys(step["name"] for step in steps):
+            values = sorted(latencies.get(name, []))
+            if not values:
+                missed.append(name)
+                continue
+            failed = sum(failures.get(name, {}).values())
+            total += len(values)
+            errors += failed
+            self.stdout.write(
+                f"{name[:60]:<60} {len(values):>6} {failed:>6}"
+                + "".join(
+                    f" {percentile(values, share) * 1000:7.1f}"
+                    for share in (0.5, 0.95, 0.99)
+                )
+                + f" {values[-1] * 1000:7.1f}"
+            )
+        for name, statuses in failures.items():
+            self.stdout.write(self.style.ERROR(
+                f"{name}: ожидался {expected[name]},"
+                f" получено {dict(statuses)}"
+            ))
+        for name in missed:
+            self.stdout.write(self.style.ERROR(f"{name}: не выполнялся"))
+        for user in users:
+            if user.crash is not None:
+                self.stdout.write(self.style.ERROR(
+                    f"Пользователь {user.number} остановился:\n{user.crash}"
+                ))
+        rate = errors / total * 100 if total else 0
+        self.stdout.write(
+            f"запросов {total} за {elapsed:.1f} с"
+            f" ({total / elapsed:.1f} в секунду), ошибок {errors}"
+            f" ({rate:.1f}%), не выполнено шагов {len(missed)}"
+        )
+        return errors, len(missed)
@@ -0,0 +1,26 @@
+from collections import Counter
+from threading import Lock
+
+counters = Counter()
+lock = Lock()
+
+
+def increment(name, value=1, **labels):
+    """Увеличить счётчик name с метками labels в памяти процесса"""
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] += value
+
+
+def render():
+    """Счётчики процесса в текстовом формате Prometheus"""
+    with lock:
+        items = sorted(counters.items())
+    lines = []
+    for (name, labels), value in items:
+        if labels:
+            name += '{%s}' % ','.join(
+                f'{label}="{label_value}"' for label, label_value in labels
+            )
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
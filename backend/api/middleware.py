@@ -0,0 +1,181 @@
+import hashlib
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+from api import metrics
+from api.deadlines import Deadline, DeadlineExceeded
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSORS = {'gzip': compress_string}
+if brotli is not None:
+    COMPRESSORS = {'br': partial(brotli.compress, quality=5), **COMPRESSORS}
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, которые клиент не запретил через q=0"""
+    accepted = set()
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    for encoding in COMPRESSORS:
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Сжатие ответов в brotli или gzip по Accept-Encoding.
+    Для путей из COMPRESSION_CACHE_PATHS сжатые байты кешируются
+    по хешу содержимого, чтобы не сжимать одно и то же заново.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding is None:
+            return response
+
+        compressed_content = self.compress(request, response, encoding)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress(request, response, encoding):
+        if not request.path.startswith(settings.COMPRESSION_CACHE_PATHS):
+            return COMPRESSORS[encoding](response.content)
+        digest = hashlib.blake2b(response.content, digest_size=16)
+        key = f'compressed:{encoding}:{digest.hexdigest()}'
+        compressed_content = cache.get(key)
+        if compressed_content is None:
+            compressed_content = COMPRESSORS[encoding](response.content)
+            cache.set(key, compressed_content,
+                      settings.COMPRESSION_CACHE_TIMEOUT)
+        return compressed_content
+
+
+def queue_time(request):
+    """
+    Сколько секунд запрос ждал воркера: nginx пишет время приёма
+    в X-Request-Start как t=<секунды с мс>.
+    """
+    header = request.META.get('HTTP_X_REQUEST_START', '')
+    try:
+        started = float(header.removeprefix('t='))
+    except ValueError:
+        return None
+    return time.time() - started
+
+
+def overloaded(detail, retry_after):
+    response = JsonResponse({'detail': detail}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Сброс нагрузки: ответ 503 с Retry-After, не выполняя запрос, если
+    он ждал в очереди дольше LOAD_SHED_QUEUE_TIME секунд или в процессе
+    уже выполняется LOAD_SHED_MAX_CONCURRENCY запросов. Клиент, который
+    не дождался бы ответа, не занимает воркер.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def __call__(self, request):
+        if request.path.startswith(settings.LOAD_SHED_EXEMPT_PATHS):
+            return self.get_response(request)
+        waited = queue_time(request)
+        if waited is not None and waited > settings.LOAD_SHED_QUEUE_TIME:
+            return self.shed('queue')
+        with self.lock:
+            limit = settings.LOAD_SHED_MAX_CONCURRENCY
+            if limit and self.active >= limit:
+                return self.shed('concurrency')
+            self.active += 1
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    @staticmethod
+    def shed(reason):
+        metrics.increment('requests_shed_total', reason=reason)
+        return overloaded('Сервер перегружен, повторите запрос позже',
+                          settings.LOAD_SHED_RETRY_AFTER)
+
+
+class DeadlineMiddleware:
+    """
+    Бюджет времени запроса из REQUEST_DEADLINES: запросы к базе
+    ограничены statement_timeout, а после срока не выполняются,
+    и клиент получает 503.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.deadline = Deadline(time.monotonic())
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(request.deadline)
+                )
+            response = self.get_response(request)
+        request.deadline.reset()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.deadline.start(request.resolver_match)
+
+    def process_exception(self, request, exception):
+        # Представления DRF отвечают на DeadlineExceeded сами.
+        if isinstance(exception, DeadlineExceeded):
+            return overloaded(exception.detail, exception.wait)
@@ -0,0 +1,150 @@
+import hashlib
+import uuid
+from functools import partial
+from time import monotonic, sleep, time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+from api import metrics
+from api.renderers import FastJSONRenderer
+
+# Параметры списка рецептов, по которым страницы кешируются для гостей.
+# С любыми другими параметрами запрос идёт мимо кеша.
+CACHED_PARAMS = ('page', 'limit', 'tags', 'author', 'ordering')
+# Сколько ждать страницу, которую уже собирает другой запрос.
+WAIT_STEP = 0.02
+
+
+def version_key(tag):
+    # В теге бывают слаги из запроса, а memcached не примет в ключе
+    # пробелы и не-ASCII.
+    return 'page-cache-version:' + hashlib.blake2b(
+        tag.encode(), digest_size=16
+    ).hexdigest()
+
+
+def bump(*tags):
+    """Пометить устаревшими все страницы, зависящие от этих тегов"""
+    cache.set_many(
+        {version_key(tag): uuid.uuid4().hex for tag in tags}, None
+    )
+
+
+def bump_on_commit(*tags):
+    """
+    bump после коммита транзакции. До коммита другие запросы ещё читают
+    старые данные и сохранили бы их под новой версией.
+    """
+    transaction.on_commit(partial(bump, *tags))
+
+
+def versions(tags):
+    keys = {version_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # Потерянная версия получает новое значение, и страницы,
+        # собранные при старой, считаются устаревшими.
+        cache.add(key, uuid.uuid4().hex, None)
+        found[key] = cache.get(key)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def list_tags(params):
+    """От каких тегов зависит страница списка с такими фильтрами"""
+    params = dict(params)
+    if 'author' in params:
+        tags = ['global', f'author:{params["author"][0]}']
+    elif 'tags' in params:
+        tags = ['global'] + [f'tag:{slug}' for slug in params['tags']]
+    else:
+        tags = ['global', 'list']
+    if 'ordering' in params:
+        tags.append('trending')
+    return tags
+
+
+def recipe_tags(recipe, slugs=()):
+    return [
+        'list',
+        f'author:{recipe.author_id}',
+        f'recipe:{recipe.pk}',
+        *(f'tag:{slug}' for slug in slugs),
+    ]
+
+
+def anonymous_params(request):
+    """
+    Нормализованные параметры запроса гостя или None, если ответ
+    кешировать нельзя.
+    """
+    if request.user.is_authenticated:
+        return None
+    if (request.accepted_renderer.format != 'json'
+            or not set(request.query_params) <= set(CACHED_PARAMS)):
+        metrics.increment('page_cache_requests_total', result='bypass')
+        return None
+    return tuple(
+        (name, tuple(sorted(set(request.query_params.getlist(name)))))
+        for name in CACHED_PARAMS
+        if name in request.query_params
+    )
+
+
+def cached_response(entry, result):
+    metrics.increment('page_cache_requests_total', result=result)
+    response = HttpResponse(entry['body'], content_type='application/json')
+    response['X-Cache'] = result
+    return response
+
+
+def wait_for(key):
+    deadline = monotonic() + settings.PAGE_CACHE_WAIT
+    while monotonic() < deadline:
+        sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cached_page(request, parts, tags, build):
+    """
+    Ответ для гостя из общего кеша. Свежая страница отдаётся сразу.
+    Устаревшую по времени или по версиям тегов пересобирает один
+    запрос, а остальные, пока он работает, получают старую копию.
+    """
+    key = 'page-cache:' + hashlib.blake2b(repr((
+        request.scheme, request.get_host(), parts
+    )).encode()).hexdigest()
+    current = versions(tags)
+    entry = cache.get(key)
+    if (entry is not None and entry['versions'] == current
+            and time() < entry['fresh_until']):
+        return cached_response(entry, 'hit')
+    lock = f'{key}:lock'
+    locked = cache.add(lock, True, settings.PAGE_CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            return cached_response(entry, 'stale')
+        entry = wait_for(key)
+        if entry is not None:
+            return cached_response(entry, 'wait')
+    try:
+        response = build()
+        if response.status_code == 200:
+            body = getattr(response, 'data', None)
+            cache.set(key, {
+                'body': (response.content if body is None
+                         else FastJSONRenderer().render(body)),
+                'versions': current,
+                'fresh_until': time() + settings.PAGE_CACHE_FRESH,
+            }, settings.PAGE_CACHE_FRESH + settings.PAGE_CACHE_STALE)
+    finally:
+        if locked:
+            cache.delete(lock)
+    metrics.increment('page_cache_requests_total', result='miss')
+    response['X-Cache'] = 'miss'
+    return response
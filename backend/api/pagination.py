@@ -1,5 +1,17 @@
+from django.conf import settings
 from rest_framework.pagination import PageNumberPagination
 
+from recipes.paginators import EstimatedCountPaginator
+
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+    max_page_size = settings.PAGINATION_MAX_LIMIT
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_estimated'] = (
+            self.page.paginator.count_is_estimated
+        )
+        return response
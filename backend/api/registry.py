@@ -0,0 +1,85 @@
+from collections import namedtuple
+from time import monotonic
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Ingredient, Tag
+
+VERSION_KEY = 'registry-version'
+
+IngredientRecord = namedtuple(
+    'IngredientRecord', ('id', 'name', 'measurement_unit')
+)
+TagRecord = namedtuple('TagRecord', ('id', 'name', 'color', 'slug'))
+Snapshot = namedtuple('Snapshot', ('version', 'ingredients', 'tags'))
+
+_snapshot = None
+_checked_at = 0.0
+
+
+def registry_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def bump_registry_version():
+    """Заставить воркеры перечитать ингредиенты и теги"""
+    global _checked_at
+    _checked_at = 0.0
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def load(version):
+    return Snapshot(
+        version,
+        MappingProxyType({
+            row[0]: IngredientRecord(*row)
+            for row in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        }),
+        MappingProxyType({
+            row[0]: TagRecord(*row)
+            for row in Tag.objects.values_list('id', 'name', 'color', 'slug')
+        }),
+    )
+
+
+def current(force=False):
+    """
+    Снимок ингредиентов и тегов этого воркера. Версия в общем кеше
+    сверяется не чаще раза в REGISTRY_CHECK_INTERVAL секунд.
+    """
+    global _snapshot, _checked_at
+    now = monotonic()
+    if (not force and _snapshot is not None
+            and now - _checked_at < settings.REGISTRY_CHECK_INTERVAL):
+        return _snapshot
+    version = registry_version()
+    if force or _snapshot is None or _snapshot.version != version:
+        _snapshot = load(version)
+    _checked_at = now
+    return _snapshot
+
+
+def records(kind, ids):
+    """
+    Таблица ingredients или tags, в которой есть все ids. Если чего-то
+    нет, снимок перечитывается сразу, не дожидаясь проверки версии.
+    """
+    table = getattr(current(), kind)
+    if any(pk not in table for pk in ids):
+        table = getattr(current(force=True), kind)
+    return table
+
+
+def ingredient(pk):
+    return records('ingredients', (pk,)).get(pk)
+
+
+def tag(pk):
+    return records('tags', (pk,)).get(pk)
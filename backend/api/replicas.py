@@ -0,0 +1,88 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from api import metrics
+from api.utils import request_cache
+
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+def pin_key(user):
+    return f'replica-pin:{user.pk}'
+
+
+def pin_to_primary(user):
+    """После записи читать данные пользователя с основной базы"""
+    cache.set(pin_key(user), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(pin_key(user), False)
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Обёртка соединений: считает выполненные запросы по базам. Роутер
+    вызывается и без запроса к базе, поэтому долю чтений с реплик
+    считают здесь.
+    """
+    metrics.increment('db_queries_total',
+                      database=context['connection'].alias)
+    return execute(sql, params, many, context)
+
+
+class ReplicaRouter:
+    """
+    Чтение с реплик из REPLICA_DATABASES, если запрос разрешил это
+    через ReplicaReadMixin; всё остальное — с основной базы.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and settings.REPLICA_DATABASES:
+            return random.choice(settings.REPLICA_DATABASES)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы к действиям из replica_actions (все, если None)
+    читают с реплик, пока пользователь не закреплён за основной базой.
+    """
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.can_read_from_replica(request):
+            replica_reads.set(True)
+
+    def can_read_from_replica(self, request):
+        if request.method not in SAFE_METHODS or (
+            self.replica_actions is not None
+            and self.action not in self.replica_actions
+        ):
+            return False
+        memo = request_cache(request)
+        if 'replica_pinned' not in memo:
+            memo['replica_pinned'] = is_pinned(request.user)
+        return not memo['replica_pinned']
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_reads.set(False)
+        if (request.method not in SAFE_METHODS
+                and request.user.is_authenticated
+                and response.status_code < 400):
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
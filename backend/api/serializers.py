@@ -1,21 +1,41 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
-from rest_framework.validators import UniqueTogetherValidator
+from rest_framework.reverse import reverse
 from rest_framework.serializers import ModelSerializer, BooleanField
-
+from rest_framework.settings import api_settings
+
+from api import registry
+from api.events import publish_new_recipe
+from api.uploads import ImageUploadField, UploadsSerializerMixin
+from api.utils import insert_or_ignore, request_cache
+from api.view_counts import views_requested
+from jobs.models import Job
+from jobs.queue import enqueue
 from recipes.models import (
     Ingredient, IngredientInRecipe, Recipe,
     Tag, UserRecipeDependence, Favorite, ShoppingCart)
 from recipes.constants import MIN_VALUE, MAX_VALUE
-from users.models import Subscribe
+from users.models import STATS_FIELDS, Subscribe
 
 User = get_user_model()
 
 
+def create_or_reject(instance, message):
+    """Вставка одним запросом; повторная вставка — ошибка валидации"""
+    if not insert_or_ignore(instance):
+        raise serializers.ValidationError(
+            {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+        )
+    return instance
+
+
 class NewUserCreateSerializer(UserCreateSerializer):
     class Meta:
         model = User
@@ -25,7 +45,15 @@ class NewUserCreateSerializer(UserCreateSerializer):
         )
 
 
+def stats_requested(request):
+    """Просил ли клиент счётчики автора: ?with_stats=1"""
+    return request is not None and request.query_params.get(
+        'with_stats'
+    ) in ('1', 'true')
+
+
 class NewUserSerializer(UserSerializer):
+    """Профиль; счётчики автора отдаются только по ?with_stats=1"""
     is_subscribed = SerializerMethodField(read_only=True)
 
     class Meta:
@@ -40,14 +68,27 @@ class NewUserSerializer(UserSerializer):
             'avatar'
         )
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if stats_requested(self.context.get('request')):
+            for name in STATS_FIELDS:
+                fields.setdefault(name, serializers.IntegerField(
+                    read_only=True
+                ))
+        return fields
+
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and user.subscriber.filter(id=obj.id).exists())
+        request = self.context.get('request')
+        cache = request_cache(request)
+        key = ('is_subscribed', obj.pk)
+        if key not in cache:
+            cache[key] = (request.user.is_authenticated and request.user
+                          .subscriber.filter(author=obj).exists())
+        return cache[key]
 
 
-class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(allow_null=True)
+class AvatarSerializer(UploadsSerializerMixin, serializers.ModelSerializer):
+    avatar = ImageUploadField(allow_null=True)
 
     class Meta:
         model = User
@@ -55,7 +96,7 @@ class AvatarSerializer(serializers.ModelSerializer):
 
 
 class SubscribeSerializer(NewUserSerializer):
-    recipes_count = serializers.ReadOnlyField(source='recipes.count')
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = SerializerMethodField()
 
     class Meta(NewUserSerializer.Meta):
@@ -86,20 +127,22 @@ class SubscribeCreateSerializer(serializers.ModelSerializer):
             'user',
             'author'
         )
-        validators = [
-            UniqueTogetherValidator(
-                queryset=model.objects.all(),
-                fields=('author', 'user'),
-                message='Вы уже подписаны на этого пользователя',
-            )
-        ]
 
-    def validate(self, author):
-        if self.context['request'].user == author:
+    def validate(self, data):
+        if self.context['request'].user == data.get('author'):
             raise serializers.ValidationError('Нельзя подписаться на себя')
-        return author
+        return data
+
+    def create(self, validated_data):
+        return create_or_reject(
+            self.Meta.model(**validated_data),
+            'Вы уже подписаны на этого пользователя'
+        )
 
     def to_representation(self, instance):
+        if stats_requested(self.context.get('request')):
+            # Счётчики только что изменились запросом UPDATE.
+            instance.author.refresh_from_db(fields=STATS_FIELDS)
         return SubscribeSerializer(instance.author, context=self.context).data
 
 
@@ -112,15 +155,13 @@ class IngredientSerializer(ModelSerializer):
 class TagSerializer(ModelSerializer):
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug')
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.ReadOnlyField(source='ingredient.id')
-    name = serializers.ReadOnlyField(source='ingredient.name')
-    measurement_unit = serializers.ReadOnlyField(
-        source='ingredient.measurement_unit'
-    )
+    id = serializers.ReadOnlyField(source='ingredient_id')
+    name = SerializerMethodField()
+    measurement_unit = SerializerMethodField()
 
     class Meta:
         model = IngredientInRecipe
@@ -131,6 +172,12 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
             'amount'
         )
 
+    def get_name(self, obj):
+        return registry.ingredient(obj.ingredient_id).name
+
+    def get_measurement_unit(self, obj):
+        return registry.ingredient(obj.ingredient_id).measurement_unit
+
 
 class RecipeReadSerializer(ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
@@ -140,6 +187,7 @@ class RecipeReadSerializer(ModelSerializer):
     image = Base64ImageField()
     is_favorited = BooleanField(read_only=True, default=False)
     is_in_shopping_cart = BooleanField(read_only=True, default=False)
+    views = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -154,8 +202,15 @@ class RecipeReadSerializer(ModelSerializer):
             'image',
             'text',
             'cooking_time',
+            'views',
         )
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if not views_requested(self.context.get('request')):
+            del fields['views']
+        return fields
+
     def get_is_favorited(self, obj):
         return self.get_is_in_user_field(obj, 'recipes_favorite_related')
 
@@ -183,7 +238,7 @@ class IngredientInRecipeWriteSerializer(ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeWriteSerializer(ModelSerializer):
+class RecipeWriteSerializer(UploadsSerializerMixin, ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True
     )
@@ -191,7 +246,7 @@ class RecipeWriteSerializer(ModelSerializer):
     ingredients = IngredientInRecipeWriteSerializer(
         many=True, write_only=True
     )
-    image = Base64ImageField()
+    image = ImageUploadField()
 
     class Meta:
         model = Recipe
@@ -244,6 +299,8 @@ class RecipeWriteSerializer(ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredients_amounts(recipe, ingredients)
+        transaction.on_commit(partial(publish_new_recipe, recipe))
+        enqueue('recipes.duplicates.update_signature', recipe_id=recipe.pk)
         return recipe
 
     @transaction.atomic
@@ -253,6 +310,8 @@ class RecipeWriteSerializer(ModelSerializer):
         instance.ingredients.clear()
         ingredients = validated_data.pop('ingredients')
         self.create_ingredients_amounts(instance, ingredients)
+        enqueue('recipes.duplicates.update_signature',
+                recipe_id=instance.pk)
         return super().update(instance, validated_data)
 
     def to_representation(self, recipe):
@@ -272,21 +331,24 @@ class RecipeShortSerializer(ModelSerializer):
         )
 
 
+class DuplicateSerializer(RecipeShortSerializer):
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = RecipeShortSerializer.Meta.fields + ('similarity',)
+
+
 class UserRecipeDependenceSerializer(serializers.ModelSerializer):
     """Добавлен ли рецепт в избранное"""
     class Meta:
         model = UserRecipeDependence
         fields = ('user', 'recipe')
 
-    def validate(self, data):
-        user_id = data.get('user').id
-        recipe_id = data.get('recipe').id
-        if self.Meta.model.objects.filter(user=user_id,
-                                          recipe=recipe_id).exists():
-            raise serializers.ValidationError(
-                'Вы уже добавили этот рецепт'
-            )
-        return data
+    def create(self, validated_data):
+        return create_or_reject(
+            self.Meta.model(**validated_data),
+            'Вы уже добавили этот рецепт'
+        )
 
     def to_representation(self, instance):
         serializer = RecipeShortSerializer(
@@ -305,3 +367,43 @@ class ShoppingCartCreateSerializer(UserRecipeDependenceSerializer):
     """Добавлен ли рецепт в корзину"""
     class Meta(UserRecipeDependenceSerializer.Meta):
         model = ShoppingCart
+
+
+class JobSerializer(ModelSerializer):
+    """Статус задачи; готовый файл отдаётся по ссылке download"""
+    download = SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = (
+            'id',
+            'queue',
+            'status',
+            'attempts',
+            'download',
+            'created',
+            'finished',
+        )
+
+    def get_download(self, obj):
+        if obj.status != Job.DONE:
+            return None
+        return reverse('api:jobs-download', args=[obj.pk],
+                       request=self.context.get('request'))
+
+
+class BatchItemSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET'], default='GET')
+    path = serializers.RegexField(r'^/api/')
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, requests):
+        if len(requests) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f'Не больше {settings.BATCH_MAX_REQUESTS} запросов за раз'
+            )
+        return requests
@@ -0,0 +1,60 @@
+import csv
+import io
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from recipes.models import IngredientInRecipe
+
+
+def shopping_list_items(user_id):
+    """Сводный список ингредиентов из корзины пользователя"""
+    return (
+        IngredientInRecipe.objects.filter(
+            recipe__recipes_shoppingcart_related__user=user_id
+        )
+        .values_list('ingredient__name', 'ingredient__measurement_unit')
+        .annotate(amount=Sum('amount'))
+        .order_by('ingredient__name')
+    )
+
+
+def render_text(items):
+    purchased = ['Список покупок:', ]
+    for name, measurement_unit, amount in items:
+        purchased.append(f'{name}: {amount}, {measurement_unit}')
+    return '\n'.join(purchased).encode()
+
+
+def render_csv(items):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, measurement_unit, amount in items:
+        writer.writerow((name, amount, measurement_unit))
+    return output.getvalue().encode()
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_text),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+}
+
+
+def shopping_list_etag(user, file_type):
+    return f'"{user.pk}-{user.shopping_cart_version}-{file_type}"'
+
+
+def shopping_list_document(user, file_type):
+    """
+    Готовый файл списка покупок. Пока версия корзины не изменилась,
+    он берётся из кеша и заново не собирается.
+    """
+    key = f'shopping-list:{user.pk}:{user.shopping_cart_version}:{file_type}'
+    document = cache.get(key)
+    if document is None:
+        render = SHOPPING_LIST_FORMATS[file_type][1]
+        document = render(shopping_list_items(user.pk))
+        cache.set(key, document, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return document
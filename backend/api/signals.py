@@ -0,0 +1,215 @@
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.db.models import F
+from django.dispatch import receiver
+
+from api import page_cache
+from api.registry import bump_registry_version
+from api.replicas import count_query
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.paginators import bump_count_version
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Объект соединения переживает переподключения, обёртка ставится раз.
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def count_changed_on_create(sender, created, **kwargs):
+    if created:
+        bump_count_version(sender)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def count_changed_on_delete(sender, **kwargs):
+    bump_count_version(sender)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(pre_delete, sender=IngredientInRecipe)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    User.bump_shopping_cart_versions(
+        recipes_shoppingcart_related__recipe=instance.recipe_id
+    )
+    Recipe.touch(pk=instance.recipe_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    User.bump_shopping_cart_versions(pk=instance.user_id)
+
+
+@receiver(pre_save, sender=ShoppingCart)
+def shopping_cart_moved(sender, instance, **kwargs):
+    # Запись корзины, переданная другому пользователю, меняет
+    # и корзину прежнего владельца.
+    if instance.pk is not None:
+        User.bump_shopping_cart_versions(
+            recipes_shoppingcart_related__pk=instance.pk
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if not created:
+        User.bump_shopping_cart_versions(
+            recipes_shoppingcart_related__recipe__ingredients=instance
+        )
+        Recipe.touch(ingredients=instance)
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.touch(tags=instance)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    Recipe.touch(tags=instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        Recipe.touch(pk=instance.pk)
+    elif reverse and action in ('post_add', 'post_remove'):
+        Recipe.touch(pk__in=pk_set)
+    elif reverse and action == 'pre_clear':
+        Recipe.touch(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def registry_changed(sender, **kwargs):
+    bump_registry_version()
+
+
+def change_tag_counts(delta, **filters):
+    Tag.objects.filter(**filters).update(
+        recipes_count=F('recipes_count') + delta
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def tag_counts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and reverse:
+        change_tag_counts(len(pk_set), pk=instance.pk)
+    elif action == 'post_add':
+        change_tag_counts(1, pk__in=pk_set)
+    elif action in ('pre_remove', 'pre_clear'):
+        # Считаются только связи, которые действительно есть.
+        links = sender.objects.filter(
+            **{'tag_id' if reverse else 'recipe_id': instance.pk}
+        )
+        if action == 'pre_remove':
+            links = links.filter(
+                **{'recipe_id__in' if reverse else 'tag_id__in': pk_set}
+            )
+        if reverse:
+            change_tag_counts(-links.count(), pk=instance.pk)
+        else:
+            change_tag_counts(-1, pk__in=links.values('tag_id'))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_tag_counts_changed(sender, instance, **kwargs):
+    # Связи удаляются каскадом, без m2m_changed.
+    change_tag_counts(-1, recipes=instance)
+
+
+@receiver(post_save, sender=Recipe)
+def author_recipes_added(sender, instance, created, **kwargs):
+    if created and instance.author_id:
+        User.change_stats('recipes_count', 1, pk=instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def author_recipes_removed(sender, instance, **kwargs):
+    if instance.author_id:
+        User.change_stats('recipes_count', -1, pk=instance.author_id)
+
+
+@receiver(post_save, sender=Subscribe)
+def author_followers_added(sender, instance, created, **kwargs):
+    if created:
+        User.change_stats('followers_count', 1, pk=instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def author_followers_removed(sender, instance, **kwargs):
+    User.change_stats('followers_count', -1, pk=instance.author_id)
+
+
+@receiver(post_save, sender=Favorite)
+def author_favorites_added(sender, instance, created, **kwargs):
+    if created:
+        User.change_stats('favorites_received', 1,
+                          recipes=instance.recipe_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def author_favorites_removed(sender, instance, **kwargs):
+    # При удалении рецепта избранное удаляется раньше него,
+    # так что автор ещё находится.
+    User.change_stats('favorites_received', -1,
+                      recipes=instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(pre_delete, sender=Recipe)
+def recipe_pages_changed(sender, instance, **kwargs):
+    page_cache.bump_on_commit(*page_cache.recipe_tags(
+        instance, instance.tags.values_list('slug', flat=True)
+    ))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tag_pages_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if reverse:
+        if action.startswith('post_'):
+            page_cache.bump_on_commit('global')
+        return
+    if action == 'pre_clear':
+        slugs = instance.tags.values_list('slug', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        slugs = Tag.objects.filter(pk__in=pk_set).values_list(
+            'slug', flat=True
+        )
+    else:
+        return
+    page_cache.bump_on_commit(*(f'tag:{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def all_pages_changed(sender, **kwargs):
+    page_cache.bump_on_commit('global')
+
+
+@receiver(post_save, sender=User)
+def author_pages_changed(sender, instance, created, **kwargs):
+    # save() пишет все поля, поэтому смотрим, что изменилось: вход
+    # и смена пароля не должны сбрасывать кеш страниц.
+    if created or not instance.page_fields_changed():
+        return
+    page_cache.bump_on_commit('global')
+    Recipe.touch(author=instance)
@@ -0,0 +1,15 @@
+from django.contrib.auth import get_user_model
+
+from api.shopping_list import SHOPPING_LIST_FORMATS, shopping_list_document
+
+User = get_user_model()
+
+
+def render_shopping_cart(user_id, file_type='txt'):
+    """Фоновая задача: файл списка покупок для скачивания"""
+    user = User.objects.get(pk=user_id)
+    return {
+        'filename': f'shopping_list.{file_type}',
+        'content_type': SHOPPING_LIST_FORMATS[file_type][0],
+        'content': shopping_list_document(user, file_type).decode(),
+    }
@@ -0,0 +1,947 @@
+import asyncio
+import json
+import tempfile
+import time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import metrics, page_cache, trending
+from api.deadlines import Deadline
+from api.db_serializers import recipe_document, recipe_documents
+from api.events import (EVENTS_PATH, LocalBroker, PostgresBroker,
+                        check_broker, events_application, issue_ticket,
+                        offer, publish_new_recipe, ticket_user)
+from api.fast_serializers import recipe_values, represent_recipes
+from api.middleware import LoadSheddingMiddleware
+from api.serializers import RecipeReadSerializer
+from api.uploads import TOKEN_PREFIX, check_image
+from api.throttling import (ActionThrottle, CacheSlidingWindow,
+                            LocalTokenBuckets)
+from api.views import RecipeViewSet
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+class RecipeReadParityMixin:
+    """Рецепты, пользователи и подписки для сравнения способов чтения"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='x',
+            avatar='avatar/author.png',
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Рецептов', password='x',
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                author=cls.author if number else None,
+                name=f'Рецепт {number}',
+                text='Описание "в кавычках" и\nперенос строки',
+                image=f'recipes/{number}.png',
+                cooking_time=number + 1,
+            )
+            # Связи с тегами добавляются не в порядке id тегов.
+            for tag in reversed(tags[:number % 3 + 1]):
+                recipe.tags.add(tag)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=number * 10 + 1)
+                for ingredient in ingredients[:number + 1]
+            )
+        recipes = list(Recipe.objects.order_by('id'))
+        Favorite.objects.create(user=cls.reader, recipe=recipes[1])
+        ShoppingCart.objects.create(user=cls.reader, recipe=recipes[2])
+        Subscribe.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_request(self, user, **params):
+        request = Request(APIRequestFactory().get('/api/recipes/', params))
+        request.user = user
+        return request
+
+    def get_queryset(self, request):
+        view = RecipeViewSet(request=request, action='list',
+                             format_kwarg=None)
+        return view.get_queryset()
+
+    def serializer_data(self, queryset, request):
+        return json.loads(JSONRenderer().render(RecipeReadSerializer(
+            queryset, many=True, context={'request': request}
+        ).data))
+
+    def requests(self):
+        """Гость, подписчик и автор, с recipes_limit и без него"""
+        return [
+            (f'{user} {params}', self.get_request(user, **params))
+            for user in (AnonymousUser(), self.reader, self.author)
+            for params in ({}, {'recipes_limit': 1})
+        ]
+
+
+class FastSerializerParityTest(RecipeReadParityMixin, TestCase):
+    """represent_recipes отдаёт тот же JSON, что и RecipeReadSerializer"""
+
+    def test_list(self):
+        for label, request in self.requests():
+            with self.subTest(label):
+                queryset = self.get_queryset(request)
+                self.assertEqual(
+                    json.loads(JSONRenderer().render(
+                        represent_recipes(recipe_values(queryset), request)
+                    )),
+                    self.serializer_data(queryset, request),
+                )
+
+    def test_detail(self):
+        for label, request in self.requests():
+            with self.subTest(label):
+                queryset = self.get_queryset(request).filter(
+                    pk=Recipe.objects.order_by('id').values('id')[1:2]
+                )
+                self.assertEqual(
+                    json.loads(JSONRenderer().render(
+                        represent_recipes(recipe_values(queryset), request)
+                    )),
+                    self.serializer_data(queryset, request),
+                )
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'JSON рецептов собирается в базе только в PostgreSQL')
+class DatabaseDocumentParityTest(RecipeReadParityMixin, TestCase):
+    """JSON из PostgreSQL совпадает с ответом RecipeReadSerializer"""
+
+    def test_list(self):
+        for label, request in self.requests():
+            with self.subTest(label):
+                queryset = self.get_queryset(request)
+                self.assertEqual(
+                    json.loads(recipe_documents(
+                        queryset.values_list('id', flat=True), request
+                    )),
+                    self.serializer_data(queryset, request),
+                )
+
+    def test_detail(self):
+        for label, request in self.requests():
+            with self.subTest(label):
+                for recipe in self.get_queryset(request):
+                    self.assertEqual(
+                        json.loads(recipe_document(recipe.pk, request)),
+                        self.serializer_data([recipe], request)[0],
+                    )
+
+    def test_missing_detail(self):
+        request = self.get_request(AnonymousUser())
+        self.assertIsNone(recipe_document(0, request))
+
+
+class BatchViewTest(TestCase):
+    """Подзапросы /api/batch/ с ответами не из JSON"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer',
+            first_name='Покупатель', last_name='Рецептов', password='x',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            image='recipes/0.png', cooking_time=1,
+        )
+        IngredientInRecipe.objects.create(
+            recipe=cls.recipe, amount=2,
+            ingredient=Ingredient.objects.create(name='Соль',
+                                                 measurement_unit='г'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *paths):
+        response = self.client.post('/api/batch/', {
+            'requests': [{'path': path} for path in paths]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['responses']
+
+    def test_empty_shopping_cart(self):
+        download, tags = self.batch(
+            '/api/recipes/download_shopping_cart/', '/api/tags/'
+        )
+        self.assertEqual((download['status'], download['body']), (400, None))
+        self.assertEqual((tags['status'], tags['body']), (200, []))
+
+    def test_text_shopping_cart(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        download, = self.batch('/api/recipes/download_shopping_cart/')
+        self.assertEqual(download['status'], 200)
+        self.assertIn('Соль', download['body'])
+
+
+class AuthorStatsTest(TestCase):
+    """Счётчики автора при добавлении и удалении избранного и подписок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='x',
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Рецептов', password='x',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            image='recipes/0.png', cooking_time=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def stats(self):
+        self.author.refresh_from_db()
+        return self.author.followers_count, self.author.favorites_received
+
+    def test_favorite(self):
+        path = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(self.client.post(path).status_code, 201)
+        self.assertEqual(self.stats(), (0, 1))
+        # Удаление одним DELETE, без чтения строки перед ним.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'recipes_favorite' in query['sql']
+        ])
+        self.assertEqual(self.client.delete(path).status_code, 400)
+        self.assertEqual(self.stats(), (0, 0))
+
+    def test_subscribe(self):
+        path = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(path).status_code, 201)
+        self.assertEqual(self.stats(), (1, 0))
+        self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertEqual(self.client.delete(path).status_code, 400)
+        self.assertEqual(self.stats(), (0, 0))
+
+
+class AuthorPagesTest(TestCase):
+    """Кеш страниц сбрасывается только при смене видимых полей автора"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='x',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.get(username='author')
+
+    def save_changes_pages(self, **changes):
+        before = page_cache.versions(['global'])
+        for name, value in changes.items():
+            setattr(self.author, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        return page_cache.versions(['global']) != before
+
+    def test_private_fields(self):
+        self.author.set_password('y')
+        self.assertFalse(self.save_changes_pages())
+        self.assertFalse(self.save_changes_pages(last_login=timezone.now()))
+
+    def test_page_fields(self):
+        self.assertTrue(self.save_changes_pages(first_name='Повар'))
+        self.assertFalse(self.save_changes_pages())
+        self.assertTrue(self.save_changes_pages(avatar='avatar/new.png'))
+
+
+class PageCacheTest(TestCase):
+    """Кеш страниц рецептов для гостей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='x',
+        )
+        cls.first, cls.second = (
+            Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                image='recipes/0.png', cooking_time=1,
+            )
+            for name in ('Первый', 'Второй')
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, path='/api/recipes/'):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.get('X-Cache'), json.loads(response.content)
+
+    def names(self, page):
+        return [recipe['name'] for recipe in page['results']]
+
+    def test_miss_then_hit(self):
+        result, page = self.get()
+        self.assertEqual(result, 'miss')
+        self.assertEqual(self.get(), ('hit', page))
+
+    def test_recipe_edit_bumps_version(self):
+        self.get()
+        self.first.name = 'Новое имя'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.save()
+        result, page = self.get()
+        self.assertEqual(result, 'miss')
+        self.assertIn('Новое имя', self.names(page))
+
+    @override_settings(TRENDING_SETTLE=0)
+    def test_favorite_bumps_trending_pages(self):
+        path = '/api/recipes/?ordering=trending'
+        trending.refresh()
+        self.assertEqual(self.names(self.get(path)[1]),
+                         ['Второй', 'Первый'])
+        self.get()
+        Favorite.objects.create(user=self.author, recipe=self.first)
+        trending.refresh()
+        result, page = self.get(path)
+        self.assertEqual(result, 'miss')
+        self.assertEqual(self.names(page), ['Первый', 'Второй'])
+        # Остальные страницы от популярности не зависят.
+        self.assertEqual(self.get()[0], 'hit')
+
+    def test_authenticated_bypass(self):
+        self.get()
+        self.client.force_authenticate(self.author)
+        result, page = self.get()
+        self.assertIsNone(result)
+        self.assertFalse(page['results'][0]['is_favorited'])
+
+    def test_stale_while_locked(self):
+        _, page = self.get()
+        add = cache.add
+
+        def locked(key, *args, **kwargs):
+            # Страницу уже пересобирает другой запрос.
+            if key.endswith(':lock'):
+                return False
+            return add(key, *args, **kwargs)
+
+        page_cache.bump('list')
+        with mock.patch.object(cache, 'add', side_effect=locked):
+            self.assertEqual(self.get(), ('stale', page))
+        self.assertEqual(self.get()[0], 'miss')
+
+    def test_bump_on_commit(self):
+        before = page_cache.versions(['list'])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    page_cache.bump_on_commit('list')
+                    raise ValueError
+            except ValueError:
+                pass
+            page_cache.bump_on_commit('list')
+            self.assertEqual(page_cache.versions(['list']), before)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(page_cache.versions(['list']), before)
+
+
+class TokenBucketsTest(SimpleTestCase):
+    """Корзины токенов в памяти процесса"""
+
+    def test_capacity_and_refill(self):
+        buckets = LocalTokenBuckets(10)
+        self.assertEqual(
+            [buckets.take('user', 2, 1.0, 100)[0] for _ in range(3)],
+            [True, True, False],
+        )
+        self.assertAlmostEqual(buckets.take('user', 2, 1.0, 100)[1], 1)
+        self.assertEqual(buckets.take('user', 2, 1.0, 101), (True, 0))
+        # За долгий простой корзина наполняется не выше ёмкости.
+        self.assertEqual(
+            [buckets.take('user', 2, 1.0, 1000)[0] for _ in range(3)],
+            [True, True, False],
+        )
+
+    def test_least_recently_used_evicted(self):
+        buckets = LocalTokenBuckets(2)
+        for key in ('first', 'second', 'first', 'third'):
+            buckets.take(key, 1, 1.0, 100)
+        self.assertEqual(list(buckets.buckets), ['first', 'third'])
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}})
+class CacheSlidingWindowTest(SimpleTestCase):
+    """Общий для воркеров лимит в кеше"""
+
+    def setUp(self):
+        cache.clear()
+        self.window = CacheSlidingWindow('default')
+
+    def test_capacity(self):
+        self.assertEqual(
+            [self.window.take('user', 3, 0.1, 300)[0] for _ in range(4)],
+            [True, True, True, False],
+        )
+        # Окно 30 секунд, следующее начинается в 330.
+        self.assertEqual(self.window.take('user', 3, 0.1, 300)[1], 30)
+        # Отказы не расходуют лимит: в новом окне прошлое весит 2/3.
+        self.assertTrue(self.window.take('user', 3, 0.1, 340)[0])
+        self.assertFalse(self.window.take('user', 3, 0.1, 340)[0])
+        self.assertTrue(self.window.take('user', 3, 0.1, 351)[0])
+
+    def test_concurrent_workers(self):
+        with ThreadPoolExecutor(8) as executor:
+            decisions = list(executor.map(
+                lambda _: self.window.take('user', 5, 0.1, 300)[0],
+                range(40),
+            ))
+        self.assertEqual(decisions.count(True), 5)
+
+
+class ActionThrottleTest(TestCase):
+    """Ответ 429 с Retry-After после исчерпания лимита действия"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Рецептов', password='x',
+        )
+
+    def setUp(self):
+        ActionThrottle.buckets = LocalTokenBuckets(10)
+        self.addCleanup(setattr, ActionThrottle, 'buckets', None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retry_after(self):
+        # avatar: 10/min, токен возвращается раз в 6 секунд.
+        statuses = [
+            self.client.delete('/api/users/me/avatar/').status_code
+            for _ in range(10)
+        ]
+        self.assertNotIn(429, statuses)
+        response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response['Retry-After']), (6, 7))
+
+
+class ShoppingListVersionTest(TestCase):
+    """ETag списка покупок меняется при любой смене корзины"""
+
+    path = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer',
+            first_name='Покупатель', last_name='Рецептов', password='x',
+        )
+        cls.salt = Ingredient.objects.create(name='Соль',
+                                             measurement_unit='г')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Описание',
+                image=f'recipes/{number}.png', cooking_time=1,
+            )
+            for number in range(2)
+        ]
+        for recipe in cls.recipes:
+            IngredientInRecipe.objects.create(recipe=recipe,
+                                              ingredient=cls.salt, amount=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        # Версия корзины читается из пользователя запроса, поэтому он
+        # загружается заново по токену, а не берётся из теста.
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.etag = response['ETag']
+        self.assertEqual(self.download().status_code, 304)
+
+    def download(self):
+        return self.client.get(self.path, HTTP_IF_NONE_MATCH=self.etag)
+
+    def assertChanged(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], self.etag)
+        return response.content.decode()
+
+    def test_cart_changed_through_api(self):
+        self.client.post(f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        self.assertIn('4', self.assertChanged())
+        self.etag = self.client.get(self.path)['ETag']
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/'
+        )
+        self.assertIn('2', self.assertChanged())
+
+    def test_cart_changed_outside_api(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[1])
+        self.assertIn('4', self.assertChanged())
+        self.etag = self.client.get(self.path)['ETag']
+        ShoppingCart.objects.filter(recipe=self.recipes[1]).delete()
+        self.assertIn('2', self.assertChanged())
+
+    def test_ingredients_changed(self):
+        IngredientInRecipe.objects.filter(recipe=self.recipes[0]).update(
+            amount=5
+        )
+        self.assertEqual(self.download().status_code, 304)
+        amount = IngredientInRecipe.objects.get(recipe=self.recipes[0])
+        amount.amount = 7
+        amount.save()
+        self.assertIn('7', self.assertChanged())
+
+    def test_recipe_deleted(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[1])
+        self.etag = self.client.get(self.path)['ETag']
+        self.recipes[0].delete()
+        self.assertNotIn('4', self.assertChanged())
+
+
+@override_settings(EVENT_HEARTBEAT=0.1)
+class EventStreamTest(TransactionTestCase):
+    """Поток /api/events/ поверх LocalBroker"""
+
+    def setUp(self):
+        broker = mock.patch('api.events.get_broker',
+                            return_value=LocalBroker())
+        broker.start()
+        self.addCleanup(broker.stop)
+        self.author, self.follower, self.stranger = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name=name, password='x',
+            )
+            for name in ('author', 'follower', 'stranger')
+        ]
+        Subscribe.objects.create(user=self.follower, author=self.author)
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipes/0.png', cooking_time=1,
+        )
+
+    def stream(self, user=None, query=None, headers=()):
+        """Запустить приложение потока, вернуть задачу и его каналы"""
+        if query is None:
+            query = f'ticket={issue_ticket(user.pk)}'
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(events_application({
+            'type': 'http',
+            'path': EVENTS_PATH,
+            'query_string': query.encode(),
+            'headers': list(headers),
+        }, incoming.get, outgoing.put))
+        return task, incoming, outgoing
+
+    async def read(self, outgoing, until):
+        """Статус ответа и тело до первого вхождения until"""
+        status, body = None, b''
+        while until not in body:
+            message = await asyncio.wait_for(outgoing.get(), 2)
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            else:
+                body += message['body']
+                if not message.get('more_body'):
+                    break
+        return status, body.decode()
+
+    async def close(self, task, incoming):
+        await incoming.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(task, 2)
+
+    def test_followers_only(self):
+        async def scenario():
+            follower = self.stream(self.follower)
+            stranger = self.stream(self.stranger)
+            for _, _, outgoing in (follower, stranger):
+                self.assertEqual(
+                    (await self.read(outgoing, b'retry'))[0], 200
+                )
+            await sync_to_async(publish_new_recipe)(self.recipe)
+            _, body = await self.read(follower[2], b'event: recipe')
+            self.assertIn(f'id: {self.recipe.pk}', body)
+            _, body = await self.read(stranger[2], b': ping')
+            self.assertNotIn('recipe', body)
+            for task, incoming, _ in (follower, stranger):
+                await self.close(task, incoming)
+
+        async_to_sync(scenario)()
+
+    def test_heartbeat_and_replay(self):
+        async def scenario():
+            task, incoming, outgoing = self.stream(
+                self.follower,
+                headers=[(b'last-event-id', str(self.recipe.pk - 1).encode())],
+            )
+            _, body = await self.read(outgoing, b': ping')
+            self.assertIn(f'id: {self.recipe.pk}', body)
+            await self.close(task, incoming)
+
+        async_to_sync(scenario)()
+
+    def test_token_header(self):
+        token = Token.objects.create(user=self.follower)
+
+        async def scenario():
+            task, incoming, outgoing = self.stream(query='', headers=[
+                (b'authorization', f'Token {token.key}'.encode()),
+            ])
+            self.assertEqual((await self.read(outgoing, b'retry'))[0], 200)
+            await self.close(task, incoming)
+
+        async_to_sync(scenario)()
+
+    def test_rejected(self):
+        token = Token.objects.create(user=self.follower)
+        ticket = issue_ticket(self.follower.pk)
+        queries = {
+            'tampered': f'ticket={ticket[:-1]}x',
+            'wrong salt': f'ticket={signing.dumps(self.follower.pk)}',
+            'token in url': f'token={token.key}',
+        }
+
+        async def status(query):
+            task, _, outgoing = self.stream(query=query)
+            await asyncio.wait_for(task, 2)
+            return (await self.read(outgoing, b'}'))[0]
+
+        for label, query in queries.items():
+            with self.subTest(label):
+                self.assertEqual(async_to_sync(status)(query), 401)
+        with override_settings(EVENT_TICKET_AGE=-1):
+            self.assertEqual(
+                async_to_sync(status)(f'ticket={ticket}'), 401
+            )
+
+
+class EventBrokerTest(SimpleTestCase):
+    """Очереди потоков и проверка брокера при старте"""
+
+    def test_overflow(self):
+        queue = asyncio.Queue(2)
+        for number in range(3):
+            offer(queue, {'type': 'recipe', 'id': number})
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), {'type': 'overflow'})
+
+    def test_ticket(self):
+        ticket = issue_ticket(5)
+        self.assertEqual(ticket_user(ticket), 5)
+        with override_settings(EVENT_TICKET_AGE=-1):
+            self.assertIsNone(ticket_user(ticket))
+
+    @override_settings(DEBUG=False)
+    def test_local_broker_warning(self):
+        for broker, warned in ((LocalBroker(), True),
+                               (PostgresBroker(), False)):
+            with self.subTest(type(broker).__name__), mock.patch(
+                'api.events.get_broker', return_value=broker
+            ), mock.patch('api.events.logger') as logger:
+                check_broker()
+                self.assertEqual(logger.warning.called, warned)
+
+
+@skipUnless('replica_0' in settings.DATABASES,
+            'Нужна реплика: задайте DB_REPLICA_HOSTS, в тестах она'
+            ' зеркалит default')
+@override_settings(REPLICA_DATABASES=['replica_0'])
+class ReplicaRoutingTest(TransactionTestCase):
+    """Какие запросы читают с реплики, а какие с основной базы"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Рецептов', password='x',
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            image='recipes/0.png', cooking_time=1,
+        )
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def request(self, method, path):
+        """Ответ и таблицы recipes_recipe, прочитанные в каждой базе"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_0']) as replica:
+            response = getattr(self.client, method)(path)
+        return response, {
+            alias: [query['sql'] for query in queries
+                    if 'recipes_recipe' in query['sql']]
+            for alias, queries in (('default', primary),
+                                   ('replica_0', replica))
+        }
+
+    def test_safe_list_reads_from_replica(self):
+        response, tables = self.request('get', '/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(tables['replica_0'])
+        self.assertFalse(tables['default'])
+
+    def test_write_and_pin_use_primary(self):
+        path = f'/api/recipes/{self.recipe.pk}/favorite/'
+        response, tables = self.request('post', path)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(tables['replica_0'])
+        # Следующее чтение этого пользователя идёт с основной базы.
+        response, tables = self.request('get', '/api/recipes/')
+        self.assertEqual(response.json()['results'][0]['is_favorited'],
+                         True)
+        self.assertTrue(tables['default'])
+        self.assertFalse(tables['replica_0'])
+
+    def test_queries_counted_per_database(self):
+        def counted(database):
+            line = f'db_queries_total{{database="{database}"}} '
+            return sum(int(row[len(line):]) for row in
+                       metrics.render().splitlines()
+                       if row.startswith(line))
+
+        before = counted('replica_0')
+        with CaptureQueriesContext(connections['replica_0']) as replica:
+            self.client.get('/api/recipes/')
+        self.assertEqual(counted('replica_0') - before, len(replica))
+
+
+class LoadSheddingTest(SimpleTestCase):
+    """Какие запросы LoadSheddingMiddleware сбрасывает с 503"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def request(self, path='/api/recipes/', waited=0):
+        return self.factory.get(
+            path, HTTP_X_REQUEST_START=f't={time.time() - waited:.3f}'
+        )
+
+    def test_long_queue_time_shed(self):
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+        response = middleware(self.request(waited=10))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'],
+                         str(settings.LOAD_SHED_RETRY_AFTER))
+        self.assertEqual(middleware(self.request()).status_code, 200)
+
+    def test_exempt_path_not_shed(self):
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+        response = middleware(self.request('/api/metrics/', waited=10))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(LOAD_SHED_MAX_CONCURRENCY=1)
+    def test_concurrency_limit(self):
+        inner = []
+
+        def get_response(request):
+            # Второй запрос приходит, пока первый ещё выполняется.
+            if not inner:
+                inner.append(middleware(self.request()))
+            return HttpResponse()
+
+        middleware = LoadSheddingMiddleware(get_response)
+        self.assertEqual(middleware(self.request()).status_code, 200)
+        self.assertEqual(inner[0].status_code, 503)
+        self.assertEqual(middleware(self.request()).status_code, 200)
+
+
+class DeadlineTest(TestCase):
+    """Срок запроса из REQUEST_DEADLINES и statement_timeout"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Рецептов', password='x',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(REQUEST_DEADLINES={'api:recipe-list': 1e-6})
+    def test_expired_deadline(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'],
+                         str(settings.LOAD_SHED_RETRY_AFTER))
+        self.assertEqual(self.client.get('/api/tags/').status_code, 200)
+
+    @override_settings(REQUEST_DEADLINES={'api:batch': 1e-6})
+    def test_parallel_batch_keeps_deadline(self):
+        response = self.client.post('/api/batch/', {
+            'requests': [{'path': '/api/tags/'},
+                         {'path': '/api/ingredients/'}],
+            'parallel': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['status'] for item in response.json()['responses']],
+            [503, 503],
+        )
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'statement_timeout есть только в PostgreSQL')
+    def test_timeout_applied_again_after_rollback(self):
+        def statement_timeout():
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW statement_timeout')
+                return cursor.fetchone()[0]
+
+        before = statement_timeout()
+        deadline = Deadline(time.monotonic())
+        deadline.expires = deadline.started + 60
+        try:
+            with transaction.atomic():
+                # SET ставится уже внутри точки сохранения и откатывается.
+                with connection.execute_wrapper(deadline):
+                    statement_timeout()
+                raise ValueError
+        except ValueError:
+            pass
+        with connection.execute_wrapper(deadline):
+            self.assertNotEqual(statement_timeout(), before)
+
+
+def image_bytes(image_format='PNG', size=(4, 3)):
+    content = BytesIO()
+    Image.new('RGB', size).save(content, image_format)
+    return content.getvalue()
+
+
+class CheckImageTest(SimpleTestCase):
+    """Проверка картинки по заголовку"""
+
+    def test_allowed_image(self):
+        self.assertEqual(check_image(ContentFile(image_bytes())),
+                         ('png', 4, 3))
+
+    def test_rejected(self):
+        for content in (b'not an image', image_bytes('BMP'),
+                        image_bytes(size=(settings.UPLOAD_MAX_DIMENSION + 1,
+                                          1))):
+            with self.subTest(content=content[:8]):
+                with self.assertRaises(ValidationError):
+                    check_image(ContentFile(content))
+
+
+class UploadTokenTest(TestCase):
+    """Ссылка из POST /api/uploads/ вместо base64"""
+
+    def setUp(self):
+        cache.clear()
+        ActionThrottle.buckets = LocalTokenBuckets(10)
+        self.addCleanup(setattr, ActionThrottle, 'buckets', None)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user, self.other = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Пользователь', last_name='Рецептов',
+                password='x',
+            )
+            for name in ('owner', 'other')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/uploads/', data=image_bytes(),
+                                    content_type='image/png')
+        self.assertEqual(response.status_code, 201)
+        self.token = response.json()['token']
+        self.upload = signing.loads(self.token[len(TOKEN_PREFIX):],
+                                    salt='api.uploads')['name']
+
+    def set_avatar(self, user=None):
+        self.client.force_authenticate(user or self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put('/api/users/me/avatar/',
+                                   {'avatar': self.token}, format='json')
+
+    def test_token_used_once(self):
+        self.assertEqual(self.set_avatar().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(default_storage.exists(self.user.avatar.name))
+        self.assertFalse(default_storage.exists(self.upload))
+        self.assertEqual(self.set_avatar().status_code, 400)
+
+    def test_expired_token(self):
+        expired = time.time() + settings.UPLOAD_TOKEN_MAX_AGE + 1
+        with mock.patch('django.core.signing.time.time',
+                        return_value=expired):
+            self.assertEqual(self.set_avatar().status_code, 400)
+        self.assertTrue(default_storage.exists(self.upload))
+
+    def test_token_of_other_user(self):
+        self.assertEqual(self.set_avatar(self.other).status_code, 400)
+        self.other.refresh_from_db()
+        self.assertFalse(self.other.avatar)
+        self.assertTrue(default_storage.exists(self.upload))
@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from api import metrics
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """'30/min' -> (30, 60): ёмкость корзины и период её наполнения"""
+    number, period = rate.split('/')
+    return int(number), DURATIONS[period[0]]
+
+
+def refill(tokens, updated, capacity, rate, now):
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class LocalTokenBuckets:
+    """Корзины токенов в памяти процесса, не больше max_size ключей"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def take(self, key, capacity, rate, now):
+        """Разрешён ли запрос и сколько секунд ждать, если нет"""
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            allowed, tokens = refill(tokens, updated, capacity, rate, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class CacheSlidingWindow:
+    """
+    Счётчики запросов в общем кеше, видимые всем воркерам. Корзину
+    токенов не обновить атомарно через API кеша Django, поэтому лимит
+    считается скользящим окном из двух счётчиков: add и incr атомарны
+    и в memcached, и в LocMem, и параллельные воркеры не пропустят
+    больше capacity запросов за окно. Окно равно времени наполнения
+    корзины, предыдущее учитывается долей, ещё не вышедшей из окна.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, rate, now):
+        """Разрешён ли запрос и сколько секунд ждать, если нет"""
+        period = capacity / rate
+        window = int(now // period)
+        current = f'{key}:{window}'
+        self.cache.add(current, 0, int(2 * period) + 1)
+        count = self.cache.incr(current)
+        previous = self.cache.get(f'{key}:{window - 1}', 0)
+        weight = 1 - (now - window * period) / period
+        excess = previous * weight + count - capacity
+        if excess <= 0:
+            return True, 0
+        # Отказ не расходует лимит.
+        self.cache.decr(current)
+        if excess <= previous * weight:
+            return False, excess / previous * period
+        return False, (window + 1) * period - now
+
+
+def make_buckets():
+    if settings.THROTTLE_CACHE:
+        return CacheSlidingWindow(settings.THROTTLE_CACHE)
+    return LocalTokenBuckets(settings.THROTTLE_MAX_KEYS)
+
+
+class ActionThrottle(BaseThrottle):
+    """
+    Ограничение частоты по корзине токенов для каждого пользователя
+    и действия. Частота берётся из DEFAULT_THROTTLE_RATES по имени действия,
+    а для APIView — по throttle_scope.
+    """
+    buckets = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'action', None) or getattr(
+            view, 'throttle_scope', None
+        )
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        if ActionThrottle.buckets is None:
+            ActionThrottle.buckets = make_buckets()
+        capacity, period = parse_rate(rate)
+        user = request.user.pk or self.get_ident(request)
+        allowed, self.retry_after = self.buckets.take(
+            f'throttle:{scope}:{user}', capacity, capacity / period,
+            time.time(),
+        )
+        metrics.increment(
+            'throttle_decisions_total',
+            scope=scope,
+            decision='allowed' if allowed else 'throttled',
+        )
+        return allowed
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,79 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api import page_cache
+from api.utils import increment
+from recipes.models import Favorite, Recipe, ShoppingCart, TrendingState
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Через сколько периодов полураспада веса пересчитываются от новой
+# точки отсчёта, чтобы они не росли до переполнения.
+REBASE_AFTER = 20
+EVENTS = (
+    ('favorite', Favorite),
+    ('shopping_cart', ShoppingCart),
+)
+
+
+def weight(moment, landmark):
+    """
+    Вес события в момент moment относительно точки отсчёта landmark.
+    Веса растут со временем, а не убывают у старых событий: так сумма
+    весов рецепта упорядочивает рецепты так же, как сумма, затухающая
+    к текущему моменту, но старые суммы не нужно пересчитывать.
+    """
+    return math.exp(
+        (moment - landmark).total_seconds() * math.log(2)
+        / settings.TRENDING_HALF_LIFE
+    )
+
+
+def event_scores(since, until, landmark):
+    scores = defaultdict(float)
+    for name, model in EVENTS:
+        rows = model.objects.filter(
+            created__gt=since, created__lte=until
+        ).values_list('recipe_id', 'created')
+        for recipe_id, created in rows.iterator():
+            scores[recipe_id] += (
+                settings.TRENDING_WEIGHTS[name] * weight(created, landmark)
+            )
+    return {
+        recipe_id: score for recipe_id, score in scores.items() if score
+    }
+
+
+def refresh(rebuild=False):
+    """
+    Добавить к популярности рецептов события, появившиеся с прошлого
+    запуска. События моложе TRENDING_SETTLE секунд ждут следующего
+    запуска, чтобы не потерять строки из ещё не завершённых транзакций.
+    Удалённые из избранного и корзины рецепты теряют вес только
+    при rebuild. Возвращает число обновлённых рецептов.
+    """
+    until = timezone.now() - timedelta(seconds=settings.TRENDING_SETTLE)
+    with transaction.atomic():
+        state, _ = TrendingState.objects.select_for_update().get_or_create(
+            pk=1, defaults={'landmark': until, 'watermark': EPOCH}
+        )
+        if rebuild:
+            Recipe.objects.exclude(trending=0).update(trending=0)
+            state.landmark, state.watermark = until, EPOCH
+        elif (until - state.landmark).total_seconds() > (
+                REBASE_AFTER * settings.TRENDING_HALF_LIFE):
+            Recipe.objects.exclude(trending=0).update(
+                trending=F('trending') * weight(state.landmark, until)
+            )
+            state.landmark = until
+        scores = event_scores(state.watermark, until, state.landmark)
+        increment(Recipe, 'trending', scores)
+        state.watermark = until
+        state.save()
+    page_cache.bump('trending')
+    return len(scores)
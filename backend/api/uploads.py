@@ -0,0 +1,168 @@
+import os
+import tempfile
+from functools import partial
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import DataAndFiles, BaseParser
+
+from api import metrics
+
+UPLOAD_DIR = 'uploads'
+# Так ссылка на загрузку отличается от base64: в нём нет двоеточия,
+# а data URL начинается с «data:».
+TOKEN_PREFIX = 'upload:'
+TOKEN_SALT = 'api.uploads'
+ALLOWED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+CHUNK_SIZE = 64 * 1024
+
+
+class TooLarge(ValidationError):
+    status_code = 413
+
+
+def size_limit_error():
+    return TooLarge(
+        f'Файл больше {settings.UPLOAD_MAX_SIZE / 2 ** 20:.1f} МиБ'
+    )
+
+
+def check_image(file):
+    """
+    Проверить формат и размеры картинки по заголовку, не раскодируя
+    пиксели. Возвращает расширение файла и размеры.
+    """
+    # Pillow загружается при первой загрузке картинки, а не при старте.
+    from PIL import Image
+
+    file.seek(0)
+    try:
+        image = Image.open(file)
+        width, height = image.size
+        extension = ALLOWED_FORMATS.get(image.format)
+        if extension is not None and max(width, height) <= (
+                settings.UPLOAD_MAX_DIMENSION):
+            image.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValidationError('Загрузите корректное изображение')
+    finally:
+        file.seek(0)
+    if extension is None:
+        raise ValidationError(
+            'Допустимые форматы: ' + ', '.join(ALLOWED_FORMATS.values())
+        )
+    if max(width, height) > settings.UPLOAD_MAX_DIMENSION:
+        raise ValidationError(
+            f'Картинка больше {settings.UPLOAD_MAX_DIMENSION} пикселей'
+            ' по стороне'
+        )
+    return extension, width, height
+
+
+class ImageUploadParser(BaseParser):
+    """
+    Картинка телом запроса. Тело пишется во временный файл кусками
+    и обрывается, как только превысит UPLOAD_MAX_SIZE.
+    """
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            raise ParseError('Пустое тело запроса')
+        file = tempfile.TemporaryFile()
+        size = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > settings.UPLOAD_MAX_SIZE:
+                file.close()
+                raise size_limit_error()
+            file.write(chunk)
+        return DataAndFiles({}, {'file': File(file, name='upload')})
+
+
+def save_upload(file, user):
+    """Сохранить проверенную картинку и выдать ссылку на неё"""
+    extension, width, height = check_image(file)
+    name = default_storage.save(
+        os.path.join(UPLOAD_DIR, f'upload.{extension}'), file
+    )
+    metrics.increment('upload_bytes_total', file.size)
+    return {
+        'token': TOKEN_PREFIX + signing.dumps(
+            {'user': user.pk, 'name': name}, salt=TOKEN_SALT
+        ),
+        'width': width,
+        'height': height,
+        'size': file.size,
+        'expires_in': settings.UPLOAD_TOKEN_MAX_AGE,
+    }
+
+
+class UploadedImage(ContentFile):
+    """Картинка по ссылке на загрузку; upload — имя временного файла"""
+
+    def __init__(self, content, name, upload):
+        super().__init__(content, name=name)
+        self.upload = upload
+
+
+class ImageUploadField(Base64ImageField):
+    """
+    Картинка в base64, как раньше, или ссылка из POST /api/uploads/.
+    Размер base64 проверяется до раскодирования, размеры картинки —
+    по заголовку.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith(TOKEN_PREFIX):
+            return self.uploaded_file(data[len(TOKEN_PREFIX):])
+        if isinstance(data, str) and len(data) * 3 // 4 > (
+                settings.UPLOAD_MAX_SIZE):
+            raise size_limit_error()
+        file = super().to_internal_value(data)
+        if file is not None:
+            check_image(file)
+        return file
+
+    def uploaded_file(self, token):
+        try:
+            upload = signing.loads(token, salt=TOKEN_SALT,
+                                   max_age=settings.UPLOAD_TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            raise ValidationError('Ссылка на загрузку неверна или устарела')
+        request = self.context.get('request')
+        if request is None or upload['user'] != request.user.pk:
+            raise ValidationError('Ссылка на загрузку неверна или устарела')
+        try:
+            with default_storage.open(upload['name']) as file:
+                content = file.read()
+        except FileNotFoundError:
+            raise ValidationError('Загруженный файл уже удалён')
+        return UploadedImage(content, os.path.basename(upload['name']),
+                             upload['name'])
+
+
+class UploadsSerializerMixin:
+    """
+    Ссылка на загрузку одноразовая: после сохранения модели временный
+    файл удаляется, и повторно ссылку не принять. Одинаковые загрузки
+    хранятся одним файлом, так что и их ссылки перестают работать.
+    """
+
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        for value in self.validated_data.values():
+            if isinstance(value, UploadedImage):
+                transaction.on_commit(
+                    partial(default_storage.delete, value.upload)
+                )
+        return instance
@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (IngredientViewSet, RecipeViewSet,
-                    TagViewSet, NewUserViewSet)
+from .views import (BatchView, EventTicketView, IngredientViewSet,
+                    JobViewSet, MetricsView, RecipeViewSet, TagViewSet,
+                    NewUserViewSet, UploadView)
 
 app_name = 'api'
 
@@ -12,8 +13,13 @@ router.register('ingredients', IngredientViewSet)
 router.register('tags', TagViewSet)
 router.register('recipes', RecipeViewSet, basename='recipe')
 router.register('users', NewUserViewSet, basename='users')
+router.register('jobs', JobViewSet, basename='jobs')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('uploads/', UploadView.as_view(), name='uploads'),
+    path('events-ticket/', EventTicketView.as_view(), name='events-ticket'),
 ]
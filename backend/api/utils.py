@@ -0,0 +1,120 @@
+from django.db import connection, connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+# Сколько строк обновляет один запрос increment().
+INCREMENT_CHUNK = 1000
+
+
+def insert_or_ignore(instance):
+    """
+    Сохранить новый объект одним INSERT ... ON CONFLICT DO NOTHING.
+    Возвращает True, если строка добавлена, и False, если такая уже есть.
+    После вставки, как и после save(), отправляется post_save
+    с created=True, но pk объекта остаётся пустым.
+    """
+    meta = instance._meta
+    fields = [field for field in meta.local_concrete_fields
+              if not field.primary_key]
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING'.format(
+        quote_name(meta.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    params = [
+        field.get_db_prep_save(field.pre_save(instance, True), connection)
+        for field in fields
+    ]
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.rowcount != 1:
+                return False
+        post_save.send(
+            sender=meta.model, instance=instance, created=True,
+            update_fields=None, raw=False, using=connection.alias,
+        )
+    return True
+
+
+def delete_or_ignore(model, **filters):
+    """
+    Удалить строку model одним DELETE по равенству полей filters,
+    которые задают уникальный ключ. Возвращает число удалённых строк.
+    post_delete отправляется, только если строка удалена этим запросом:
+    delete() шлёт его и тогда, когда строку уже удалил параллельный
+    запрос, и счётчики уменьшались дважды. В instance заполнены только
+    поля из filters.
+    """
+    meta = model._meta
+    quote_name = connection.ops.quote_name
+    fields = [meta.get_field(name) for name in filters]
+    values = [
+        field.get_db_prep_value(value, connection)
+        for field, value in zip(fields, filters.values())
+    ]
+    sql = 'DELETE FROM {} WHERE {}'.format(
+        quote_name(meta.db_table),
+        ' AND '.join(f'{quote_name(field.column)} = %s' for field in fields),
+    )
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            deleted = cursor.rowcount
+        if deleted:
+            instance = model(**{
+                field.attname: value for field, value in zip(fields, values)
+            })
+            post_delete.send(sender=model, instance=instance,
+                             using=connection.alias)
+    return deleted
+
+
+def request_cache(request):
+    """
+    Словарь, который живёт до конца запроса. Подзапросы /api/batch/
+    получают словарь внешнего запроса и делят найденное между собой.
+    """
+    request = getattr(request, '_request', request)
+    if not hasattr(request, 'batch_cache'):
+        request.batch_cache = {}
+    return request.batch_cache
+
+
+def increment_sql(vendor, table, pk, column, size):
+    if vendor == 'postgresql':
+        return (
+            f'UPDATE {table} SET {column} = {table}.{column} + v.n'
+            f' FROM (VALUES {", ".join(["(%s, %s)"] * size)}) AS v(pk, n)'
+            f' WHERE {table}.{pk} = v.pk'
+        )
+    return (
+        f'UPDATE {table} SET {column} = {column} + CASE {pk}'
+        f' {" ".join(["WHEN %s THEN %s"] * size)} END'
+        f' WHERE {pk} IN ({", ".join(["%s"] * size)})'
+    )
+
+
+def increment(model, field, amounts):
+    """
+    Прибавить к полю field строк model значения amounts ({pk: сколько})
+    в одной транзакции, по INCREMENT_CHUNK строк за запрос.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    pk = quote_name(model._meta.pk.column)
+    column = quote_name(model._meta.get_field(field).column)
+    # Один порядок строк у всех пишущих, чтобы не ловить взаимные
+    # блокировки на популярных строках.
+    rows = sorted(amounts.items())
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), INCREMENT_CHUNK):
+                chunk = rows[start:start + INCREMENT_CHUNK]
+                params = [value for row in chunk for value in row]
+                if connection.vendor != 'postgresql':
+                    params += [key for key, _ in chunk]
+                cursor.execute(increment_sql(
+                    connection.vendor, table, pk, column, len(chunk)
+                ), params)
@@ -0,0 +1,86 @@
+import atexit
+from collections import Counter
+from threading import Event, Lock, Thread
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from api import metrics
+from api.utils import increment
+from recipes.models import Recipe
+
+buffer = Counter()
+lock = Lock()
+wakeup = Event()
+flusher = None
+
+
+def views_requested(request):
+    """Просил ли клиент счётчик просмотров: ?with_views=1"""
+    return request is not None and request.query_params.get(
+        'with_views'
+    ) in ('1', 'true')
+
+
+def record(recipe_id):
+    """
+    Учесть просмотр рецепта в памяти воркера. В базу просмотры уходят
+    пачкой раз в VIEW_FLUSH_INTERVAL секунд, поэтому при аварийной
+    остановке воркер теряет не больше, чем набрал за этот интервал.
+    Когда в буфере VIEW_BUFFER_MAX_KEYS рецептов, просмотры новых
+    рецептов отбрасываются до ближайшей записи.
+    """
+    global flusher
+    with lock:
+        full = (recipe_id not in buffer
+                and len(buffer) >= settings.VIEW_BUFFER_MAX_KEYS)
+        if not full:
+            buffer[recipe_id] += 1
+        if flusher is None or not flusher.is_alive():
+            flusher = Thread(target=flush_forever, daemon=True)
+            flusher.start()
+    if full:
+        metrics.increment('recipe_views_dropped_total')
+        wakeup.set()
+
+
+def flush_forever():
+    while True:
+        wakeup.wait(settings.VIEW_FLUSH_INTERVAL)
+        wakeup.clear()
+        flush()
+
+
+def flush():
+    """Записать накопленные просмотры; при ошибке вернуть их в буфер"""
+    with lock:
+        counts = dict(buffer)
+        buffer.clear()
+    if not counts:
+        return
+    close_old_connections()
+    try:
+        increment(Recipe, 'views', counts)
+    except DatabaseError:
+        metrics.increment('recipe_view_flush_errors_total')
+        restore(counts)
+    else:
+        metrics.increment('recipe_views_flushed_total', sum(counts.values()))
+    finally:
+        close_old_connections()
+
+
+def restore(counts):
+    dropped = 0
+    with lock:
+        for recipe_id, views in counts.items():
+            if (recipe_id in buffer
+                    or len(buffer) < settings.VIEW_BUFFER_MAX_KEYS):
+                buffer[recipe_id] += views
+            else:
+                dropped += views
+    if dropped:
+        metrics.increment('recipe_views_dropped_total', dropped)
+
+
+atexit.register(flush)
@@ -1,34 +1,69 @@
-from django.db.models import (Sum, BooleanField, Case,
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import (BooleanField, Case, Prefetch,
                               When, Value, OuterRef, Exists)
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.exceptions import ValidationError as APIValidationError
+from rest_framework.mixins import RetrieveModelMixin
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_400_BAD_REQUEST
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.views import APIView
+from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
+                                     ReadOnlyModelViewSet)
+
+from api import metrics
 
+from api.batch import dispatch_all
+from api.conditional import not_modified, recipe_validators, set_validators
+from api.db_serializers import (database_documents_enabled,
+                                paginated_document, recipe_document,
+                                recipe_documents)
+from api.events import issue_ticket
+from api.fast_serializers import recipe_values, represent_recipes
+from api.facets import facets_requested, tag_facets
 from api.filters import IngredientFilter, RecipeFilter
+from api.page_cache import anonymous_params, cached_page, list_tags
 from api.pagination import CustomPagination
 from api.permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
+from api.replicas import ReplicaReadMixin
+from api.throttling import ActionThrottle
+from api.uploads import ImageUploadParser, save_upload, size_limit_error
+from api.utils import delete_or_ignore
+from api.view_counts import record as record_view, views_requested
 from api.serializers import (NewUserSerializer, SubscribeSerializer,
                              SubscribeCreateSerializer,
                              IngredientSerializer, RecipeReadSerializer,
                              RecipeWriteSerializer, TagSerializer,
                              ShoppingCartCreateSerializer,
                              FavoriteCreateSerializer,
-                             AvatarSerializer
+                             AvatarSerializer, JobSerializer,
+                             BatchSerializer, DuplicateSerializer
                              )
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
-                            Recipe, ShoppingCart, Tag)
-from users.models import Subscribe, User
+from api.shopping_list import (SHOPPING_LIST_FORMATS,
+                               shopping_list_document, shopping_list_etag)
+from jobs.models import Job
+from jobs.queue import enqueue
+from recipes.duplicates import likely_duplicates
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import STATS_FIELDS, Subscribe, User
 
 
-class NewUserViewSet(UserViewSet):
+class NewUserViewSet(ReplicaReadMixin, UserViewSet):
     serializer_class = NewUserSerializer
     pagination_class = CustomPagination
+    replica_actions = ('list',)
 
     @action(methods=['get'], detail=False,
             permission_classes=[IsAuthenticated],
@@ -39,6 +74,7 @@ class NewUserViewSet(UserViewSet):
     @action(methods=['put', 'delete'],
             detail=False,
             permission_classes=[IsAuthenticated],
+            throttle_classes=[ActionThrottle],
             url_path='me/avatar', url_name='me-avatar',)
     def avatar(self, request):
         if request.method == 'PUT':
@@ -52,14 +88,16 @@ class NewUserViewSet(UserViewSet):
 
     def avatar_manipulation(self, data):
         instance = self.get_instance()
-        serializer = AvatarSerializer(instance, data=data)
+        serializer = AvatarSerializer(instance, data=data,
+                                      context={'request': self.request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return serializer
 
     @action(detail=True,
             methods=['post'],
-            permission_classes=[IsAuthenticated],)
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[ActionThrottle],)
     def subscribe(self, request, id):
         serializer = SubscribeCreateSerializer(
             data={
@@ -73,9 +111,9 @@ class NewUserViewSet(UserViewSet):
 
     @subscribe.mapping.delete
     def unsubscribe(self, request, id):
-        subscription = Subscribe.objects.filter(user=request.user, author=id)
-        if subscription.exists():
-            subscription.delete()
+        deleted = delete_or_ignore(Subscribe, user=request.user.id,
+                                   author=id)
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'error': 'Вы не подписаны на пользователя'},
@@ -88,14 +126,25 @@ class NewUserViewSet(UserViewSet):
             url_path='subscriptions',
             url_name='subscriptions',)
     def subscriptions(self, request):
+        """Подписки; ?ordering=recipes_count и т.п. — по убыванию счётчика"""
         queryset = User.objects.filter(subscribing__user=request.user)
+        ordering = request.query_params.get('ordering')
+        if ordering:
+            if ordering not in STATS_FIELDS:
+                return Response(
+                    {'ordering': [
+                        'Допустимые значения: ' + ', '.join(STATS_FIELDS)
+                    ]},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            queryset = queryset.order_by(f'-{ordering}', 'id')
         page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(page, many=True,
                                          context={'request': request})
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly,)
@@ -104,14 +153,14 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly,)
     pagination_class = None
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, ModelViewSet):
     permission_classes = (IsAuthorOrReadOnly | IsAdminOrReadOnly,)
     pagination_class = CustomPagination
     filter_backends = (DjangoFilterBackend,)
@@ -142,7 +191,102 @@ class RecipeViewSet(ModelViewSet):
                 default=Value(False),
                 output_field=BooleanField()
             )
-        ).select_related('author').prefetch_related('tags', 'ingredient_list')
+        ).select_related('author').prefetch_related(
+            # Тот же порядок, что у быстрого чтения и у JSON из базы.
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch('ingredient_list',
+                     queryset=IngredientInRecipe.objects.order_by('id')),
+        )
+
+    def list(self, request, *args, **kwargs):
+        params = anonymous_params(request)
+        if params is None:
+            return self.build_list(request)
+        return cached_page(request, ('list', params), list_tags(params),
+                           partial(self.build_list, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # Просмотры меняются без отметки времени, с ними ответ
+        # всегда собирается заново.
+        validators = None
+        if not views_requested(request):
+            validators = recipe_validators(request, lookup)
+        if validators is not None:
+            response = not_modified(request, validators)
+            if response is not None:
+                record_view(int(lookup))
+                return response
+        params = anonymous_params(request)
+        if params is None:
+            response = self.build_detail(request, **kwargs)
+        else:
+            response = cached_page(
+                request, ('detail', lookup, params),
+                ['global', f'recipe:{lookup}'],
+                partial(self.build_detail, request, **kwargs)
+            )
+        # Сюда доходят только найденные рецепты: иначе уже был 404.
+        record_view(int(lookup))
+        # Устаревшая копия из кеша старше версии из базы.
+        if validators is not None and response.get('X-Cache') != 'stale':
+            set_validators(response, validators)
+        return response
+
+    def build_list(self, request):
+        facets = facets_requested(request)
+        if (database_documents_enabled() and not views_requested(request)
+                and not facets):
+            return self.list_documents(request)
+        queryset = recipe_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(represent_recipes(queryset, request))
+        response = self.get_paginated_response(
+            represent_recipes(page, request)
+        )
+        if facets:
+            response.data['facets'] = {
+                'tags': tag_facets(request, self.get_queryset())
+            }
+        return response
+
+    def build_detail(self, request, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                pk=lookup
+            )
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        if database_documents_enabled() and not views_requested(request):
+            return self.retrieve_document(request, queryset)
+        data = represent_recipes(recipe_values(queryset), request)
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+    def list_documents(self, request):
+        ids = self.filter_queryset(self.get_queryset()).values_list(
+            'id', flat=True
+        )
+        page = self.paginate_queryset(ids)
+        if page is None:
+            return self.json_response(recipe_documents(ids, request))
+        return self.json_response(paginated_document(
+            self.get_paginated_response([]).data,
+            recipe_documents(page, request)
+        ))
+
+    def retrieve_document(self, request, queryset):
+        pk = queryset.values_list('id', flat=True).first()
+        if pk is None:
+            raise Http404
+        return self.json_response(recipe_document(pk, request))
+
+    @staticmethod
+    def json_response(content):
+        return HttpResponse(content, content_type='application/json')
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -161,18 +305,33 @@ class RecipeViewSet(ModelViewSet):
 
     @staticmethod
     def delete_from(model, request, id):
-        obj = model.objects.filter(user=request.user, recipe__id=id)
-        if obj.exists():
-            obj.delete()
+        deleted = delete_or_ignore(model, user=request.user.id, recipe=id)
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'Рецепт уже удален!'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
+    def duplicates(self, request, pk):
+        """Вероятные дубликаты рецепта для модерации"""
+        recipe = self.get_object()
+        found = likely_duplicates(recipe.pk)
+        recipes = Recipe.objects.in_bulk([pk for pk, _ in found])
+        duplicates = []
+        for recipe_id, similarity in found:
+            if recipe_id in recipes:
+                recipes[recipe_id].similarity = similarity
+                duplicates.append(recipes[recipe_id])
+        return Response(DuplicateSerializer(
+            duplicates, many=True, context={'request': request}
+        ).data)
+
     @action(detail=True,
             methods=['post', 'delete'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[ActionThrottle])
     def favorite(self, request, pk):
         if request.method == 'POST':
             return self.add_to(FavoriteCreateSerializer, request, pk)
@@ -180,7 +339,8 @@ class RecipeViewSet(ModelViewSet):
 
     @action(detail=True,
             methods=['post', 'delete'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[ActionThrottle])
     def shopping_cart(self, request, pk):
         if request.method == 'POST':
             return self.add_to(ShoppingCartCreateSerializer, request, pk)
@@ -188,27 +348,143 @@ class RecipeViewSet(ModelViewSet):
 
     @action(detail=False,
             methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[ActionThrottle])
     def download_shopping_cart(self, request):
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': 'Доступные форматы: '
+                           + ', '.join(SHOPPING_LIST_FORMATS)},
+                status=HTTP_400_BAD_REQUEST
+            )
+        etag = shopping_list_etag(request.user, file_type)
+        if etag in [tag.removeprefix('W/') for tag in parse_etags(
+            request.headers.get('If-None-Match', '')
+        )]:
+            return HttpResponseNotModified(headers={'ETag': etag})
         if not request.user.recipes_shoppingcart_related.exists():
             return Response(status=HTTP_400_BAD_REQUEST)
 
-        shopping_cart = ShoppingCart.objects.filter(user=request.user)
-        recipes = [item.recipe.id for item in shopping_cart]
-        ingredients = (
-            IngredientInRecipe.objects.filter(recipe__in=recipes)
-            .values('ingredient')
-            .annotate(amount=Sum('amount'))
+        if request.query_params.get('async'):
+            job = enqueue('api.tasks.render_shopping_cart', queue='exports',
+                          user=request.user, user_id=request.user.id,
+                          file_type=file_type)
+            return job_accepted(request, job)
+        response = HttpResponse(
+            shopping_list_document(request.user, file_type),
+            content_type=SHOPPING_LIST_FORMATS[file_type][0]
         )
-        purchased = ['Список покупок:', ]
-        for item in ingredients:
-            ingredient = Ingredient.objects.get(pk=item['ingredient'])
-            amount = item['amount']
-            purchased.append(f'{ingredient.name}: {amount}, '
-                             f'{ingredient.measurement_unit}')
-        purchased_in_file = '\n'.join(purchased)
-        response = HttpResponse(purchased_in_file, content_type='text/plain')
+        response['ETag'] = etag
         response['Content-Disposition'] = (
-            'attachment; filename=shopping_list.txt'
+            f'attachment; filename=shopping_list.{file_type}'
         )
         return response
+
+
+def job_accepted(request, job):
+    """Ответ 202 со ссылкой, по которой можно следить за задачей"""
+    return Response(
+        JobSerializer(job, context={'request': request}).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('api:jobs-detail', args=[job.id],
+                                     request=request)},
+    )
+
+
+class JobViewSet(RetrieveModelMixin, GenericViewSet):
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        queryset = Job.objects.filter(user=self.request.user)
+        if self.action != 'download':
+            # Результат — целый файл, при опросе статуса он не нужен.
+            queryset = queryset.defer('result')
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk):
+        job = self.get_object()
+        if job.status != Job.DONE:
+            return Response(
+                {'errors': 'Задача ещё не выполнена'},
+                status=status.HTTP_409_CONFLICT
+            )
+        response = HttpResponse(job.result['content'],
+                                content_type=job.result['content_type'])
+        response['Content-Disposition'] = (
+            f'attachment; filename={job.result["filename"]}'
+        )
+        return response
+
+
+class MetricsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(metrics.render(),
+                            content_type='text/plain; version=0.0.4')
+
+
+class EventTicketView(APIView):
+    """
+    Билет для /api/events/?ticket=: EventSource не передаёт заголовок
+    Authorization, а токен в адресе остался бы в логах.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        return Response({
+            'ticket': issue_ticket(request.user.id),
+            'expires_in': settings.EVENT_TICKET_AGE,
+        })
+
+
+class BatchView(APIView):
+    """Несколько GET-запросов к API одним запросом"""
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        paths = [item['path'] for item in data['requests']]
+        metrics.increment('batch_subrequests_total', len(paths))
+        return Response({
+            'responses': dispatch_all(request, paths, data['parallel'])
+        })
+
+
+class UploadView(APIView):
+    """
+    Загрузка картинки файлом формы (поле file) или телом запроса
+    с Content-Type image/*. В ответе ссылка, которую можно передать
+    в image рецепта или avatar вместо base64.
+    """
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (MultiPartParser, ImageUploadParser)
+    throttle_classes = (ActionThrottle,)
+    throttle_scope = 'upload'
+    # Запас на границы и заголовки частей формы.
+    multipart_overhead = 64 * 1024
+
+    def post(self, request):
+        try:
+            upload = self.upload(request)
+        except APIValidationError as error:
+            raise type(error)({'file': error.detail})
+        metrics.increment('uploads_total',
+                          mode=request.content_type.split('/')[0])
+        return Response(upload, status=status.HTTP_201_CREATED)
+
+    def upload(self, request):
+        length = request.META.get('CONTENT_LENGTH')
+        if length and int(length) > (
+                settings.UPLOAD_MAX_SIZE + self.multipart_overhead):
+            raise size_limit_error()
+        file = request.FILES.get('file')
+        if file is None:
+            raise APIValidationError('Обязательное поле.')
+        if file.size > settings.UPLOAD_MAX_SIZE:
+            raise size_limit_error()
+        return save_upload(file, request.user)
@@ -4,4 +4,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.events import (EVENTS_PATH, check_broker,  # noqa: E402
+                        events_application)
+
+check_broker()
+
+
+async def application(scope, receive, send):
+    """Поток событий обслуживается отдельно, остальное — Django"""
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await events_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -27,10 +27,14 @@ INSTALLED_APPS = [
     'api',
     'users',
     'recipes',
+    'jobs',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.LoadSheddingMiddleware',
+    'api.middleware.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,6 +62,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+# Загрузить URLconf и заморозить сборщик мусора при импорте backend.wsgi,
+# чтобы воркеры gunicorn --preload делили эти страницы памяти.
+# gunicorn.conf.py включает это вместе с preload_app.
+WSGI_PRELOAD = os.getenv('WSGI_PRELOAD', 'False') == 'True'
 
 DATABASES = {
     'default': {
@@ -70,6 +78,34 @@ DATABASES = {
     }
 }
 
+# Общий кеш всех процессов (gunicorn, worker, trending, events): через
+# него расходятся закрепление чтения за основной базой, версии справочника,
+# кеша страниц и оценок количества. LocMemCache виден только своему
+# процессу и годится лишь для тестов и запуска в одном процессе.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.memcached.PyMemcacheCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'memcached:11211'),
+    }
+}
+
+# Реплики для чтения: хосты через пробел в DB_REPLICA_HOSTS.
+REPLICA_DATABASES = []
+for number, host in enumerate(os.getenv('DB_REPLICA_HOSTS', '').split()):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после записи пользователь читает с основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -88,6 +124,10 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
@@ -97,8 +137,134 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
     'PAGINATE_BY_PARAM': 'limit',
+    'DEFAULT_THROTTLE_RATES': {
+        'favorite': '60/min',
+        'shopping_cart': '60/min',
+        'subscribe': '30/min',
+        'unsubscribe': '30/min',
+        'avatar': '10/min',
+        'download_shopping_cart': '20/min',
+        'upload': '30/min',
+    },
+}
+# Пусто — корзины токенов в памяти воркера, иначе имя кеша из CACHES:
+# общий для воркеров лимит считается скользящим окном.
+THROTTLE_CACHE = os.getenv('THROTTLE_CACHE', '')
+THROTTLE_MAX_KEYS = 100000
+
+# Больше стольких объектов на странице ?limit= не отдаёт.
+PAGINATION_MAX_LIMIT = int(os.getenv('PAGINATION_MAX_LIMIT', 100))
+
+# С какого числа строк вместо точного COUNT берётся оценка планировщика.
+ESTIMATED_COUNT_THRESHOLD = int(
+    os.getenv('ESTIMATED_COUNT_THRESHOLD', 100000)
+)
+# Сколько секунд API хранит оценку количества для набора фильтров.
+COUNT_ESTIMATE_TIMEOUT = 60 * 5
+
+# Ответы короче COMPRESSION_MIN_SIZE байт не сжимаются, а сжатые ответы
+# для путей из COMPRESSION_CACHE_PATHS хранятся в кеше.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_CACHE_PATHS = ('/api/ingredients/', '/api/tags/')
+COMPRESSION_CACHE_TIMEOUT = 60 * 60
+
+# Очереди фоновых задач и число процессов воркера для каждой.
+JOB_QUEUES = {
+    'default': int(os.getenv('JOB_CONCURRENCY', 2)),
+    'exports': int(os.getenv('JOB_EXPORT_CONCURRENCY', 1)),
+}
+JOB_POLL_INTERVAL = 1
+# Воркер раз в JOB_HEARTBEAT секунд отмечает свои выполняемые задачи.
+# Задача без отметки дольше JOB_TIMEOUT секунд считается брошенной
+# и возвращается в очередь, сколько бы она ни выполнялась.
+JOB_HEARTBEAT = 30
+JOB_TIMEOUT = 60 * 2
+JOB_RETRY_DELAY = 5
+
+# Сколько секунд хранится готовый файл списка покупок одной версии.
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Как часто воркер сверяет версию своей копии ингредиентов и тегов.
+REGISTRY_CHECK_INTERVAL = 5
+
+# Кеш страниц рецептов для гостей: сколько секунд страница свежая,
+# сколько ещё её можно отдать, пока один запрос собирает новую,
+# и сколько ждать, если копии ещё нет совсем.
+PAGE_CACHE_FRESH = int(os.getenv('PAGE_CACHE_FRESH', 30))
+PAGE_CACHE_STALE = 60 * 5
+PAGE_CACHE_LOCK_TIMEOUT = 10
+PAGE_CACHE_WAIT = 1
+
+# Просмотры рецептов копятся в памяти воркера и пишутся в базу раз
+# в VIEW_FLUSH_INTERVAL секунд: при аварийной остановке воркер теряет
+# не больше, чем набрал за это время. VIEW_BUFFER_MAX_KEYS ограничивает
+# число рецептов в буфере.
+VIEW_FLUSH_INTERVAL = int(os.getenv('VIEW_FLUSH_INTERVAL', 10))
+VIEW_BUFFER_MAX_KEYS = 10000
+
+# Популярные рецепты (?ordering=trending): вес добавления в избранное
+# и в корзину вдвое падает за TRENDING_HALF_LIFE секунд. Новые события
+# учитывает refresh_trending, пропуская последние TRENDING_SETTLE секунд.
+TRENDING_HALF_LIFE = int(os.getenv('TRENDING_HALF_LIFE', 60 * 60 * 24))
+TRENDING_WEIGHTS = {
+    'favorite': 1.0,
+    'shopping_cart': 1.0,
+}
+TRENDING_SETTLE = 30
+TRENDING_REFRESH_INTERVAL = int(os.getenv('TRENDING_REFRESH_INTERVAL', 300))
+
+# Загрузка картинок через /api/uploads/ и в base64: предел размера
+# файла и стороны картинки, и сколько секунд действует ссылка на
+# загрузку. Ссылка должна истекать раньше, чем cleanup_media удалит
+# неиспользованный файл (по умолчанию через час).
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 10 * 2 ** 20))
+UPLOAD_MAX_DIMENSION = 6000
+UPLOAD_TOKEN_MAX_AGE = 60 * 30
+
+# С какой оценки сходства (доля совпавших значений MinHash) рецепт
+# считается вероятным дубликатом.
+DUPLICATE_THRESHOLD = 0.7
+
+# Сколько секунд хранятся счётчики тегов (?facets=tags) для фильтра.
+FACET_CACHE_TIMEOUT = 30
+
+# Сколько подзапросов принимает /api/batch/ и сколько выполняет сразу.
+BATCH_MAX_REQUESTS = 20
+BATCH_WORKERS = 4
+
+# Рассылка событий о новых рецептах: api.events.LocalBroker — внутри
+# процесса, api.events.PostgresBroker — между процессами через NOTIFY.
+EVENT_BROKER = os.getenv('EVENT_BROKER', 'api.events.LocalBroker')
+# Сколько событий ждёт медленного клиента и как часто слать ping.
+EVENT_QUEUE_SIZE = 100
+EVENT_HEARTBEAT = 15
+# Сколько секунд билет из /api/events-ticket/ годится для открытия потока.
+EVENT_TICKET_AGE = 60
+
+# Бюджет времени запроса в секундах: первый запрос к PostgreSQL ставит
+# statement_timeout в остаток бюджета, после срока запросы к базе
+# не выполняются и клиент получает 503. В REQUEST_DEADLINES — бюджеты
+# по имени представления или пространству имён, 0 — без ограничения.
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 5))
+REQUEST_DEADLINES = {
+    'api:recipe-download-shopping-cart': 15,
+    'api:batch': 10,
+    'api:uploads': 15,
+    'admin': 30,
 }
 
+# Сброс нагрузки: 503 с Retry-After, если запрос ждал воркера дольше
+# LOAD_SHED_QUEUE_TIME секунд (по X-Request-Start от nginx) или в процессе
+# уже LOAD_SHED_MAX_CONCURRENCY запросов (0 — без предела, для потоковых
+# воркеров gunicorn).
+LOAD_SHED_QUEUE_TIME = float(os.getenv('LOAD_SHED_QUEUE_TIME', 2))
+LOAD_SHED_MAX_CONCURRENCY = int(os.getenv('LOAD_SHED_MAX_CONCURRENCY', 0))
+LOAD_SHED_RETRY_AFTER = 5
+LOAD_SHED_EXEMPT_PATHS = ('/api/metrics/',)
+
+# python — сборка ответа рецептов в Python, database — в PostgreSQL.
+RECIPE_READ_ENGINE = os.getenv('RECIPE_READ_ENGINE', 'python')
+
 DJOSER = {
     'SERIALIZERS': {
         'new_user': 'api.serializers.NewUserSerializer',
@@ -123,5 +289,6 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
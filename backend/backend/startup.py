@@ -0,0 +1,16 @@
+import gc
+
+
+def preload():
+    """
+    Загрузить приложение целиком до форка воркеров, чтобы модули
+    остались общими страницами памяти (gunicorn --preload).
+    """
+    from django.db import connections
+    from django.urls import get_resolver
+    # Pillow модули API загружают лениво, при первой картинке.
+    from PIL import Image  # noqa: F401
+
+    get_resolver().url_patterns
+    connections.close_all()
+    gc.freeze()
@@ -0,0 +1,21 @@
+import os
+
+bind = '0:9090'
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+reload = os.getenv('GUNICORN_RELOAD', 'False') == 'True'
+# С preload приложение грузится один раз в мастере и делится с воркерами.
+preload_app = not reload
+# backend.wsgi готовит приложение к разделению страниц только с preload.
+os.environ.setdefault('WSGI_PRELOAD', str(preload_app))
+
+
+def post_fork(server, worker):
+    from django.db import connections
+
+    connections.close_all()
+
+
+def worker_exit(server, worker):
+    from api.view_counts import flush
+
+    flush()
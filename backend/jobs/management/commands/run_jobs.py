@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from jobs.queue import claim, execute, heartbeat, requeue_stale
+
+
+class Command(BaseCommand):
+    help = "Выполнять фоновые задачи из базы данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-q",
+            "--queues",
+            nargs="+",
+            type=str,
+            default=list(settings.JOB_QUEUES),
+            help="Очереди, которые обслуживает воркер",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить готовые задачи и завершиться",
+        )
+
+    def make_pool(self, queue):
+        return ProcessPoolExecutor(
+            max_workers=settings.JOB_QUEUES[queue],
+            mp_context=get_context('spawn'),
+            initializer=django.setup,
+        )
+
+    def handle(self, *args, **kwargs):
+        queues = kwargs["queues"]
+        unknown = set(queues) - set(settings.JOB_QUEUES)
+        if unknown:
+            raise CommandError(f"Неизвестные очереди: {', '.join(unknown)}")
+        pools = {queue: self.make_pool(queue) for queue in queues}
+        running = {queue: {} for queue in queues}
+        last_heartbeat = time.monotonic()
+        self.stdout.write(self.style.WARNING(
+            f"Воркер запущен для очередей: {', '.join(queues)}"
+        ))
+        try:
+            while True:
+                requeue_stale()
+                claimed = 0
+                for queue in queues:
+                    running[queue] = self.collect(
+                        queue, running[queue], pools
+                    )
+                    free = settings.JOB_QUEUES[queue] - len(running[queue])
+                    for job_id in claim(queue, free):
+                        future = pools[queue].submit(execute, job_id)
+                        running[queue][future] = job_id
+                        claimed += 1
+                if time.monotonic() - last_heartbeat >= settings.JOB_HEARTBEAT:
+                    heartbeat([job_id for jobs in running.values()
+                               for job_id in jobs.values()])
+                    last_heartbeat = time.monotonic()
+                connections.close_all()
+                if kwargs["once"] and not claimed and not any(
+                    running.values()
+                ):
+                    break
+                if not claimed:
+                    time.sleep(settings.JOB_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Остановка воркера"))
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS("Воркер остановлен"))
+
+    def collect(self, queue, futures, pools):
+        """Убрать завершённые задачи и пересоздать упавший пул процессов"""
+        still_running = {}
+        for future, job_id in futures.items():
+            if not future.done():
+                still_running[future] = job_id
+                continue
+            error = future.exception()
+            if error is None:
+                continue
+            self.stderr.write(f"Ошибка воркера очереди {queue}: {error!r}")
+            if isinstance(error, BrokenProcessPool):
+                pools[queue] = self.make_pool(queue)
+        return still_running
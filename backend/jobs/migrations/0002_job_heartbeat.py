@@ -0,0 +1,25 @@
+# Generated by Django 3.2.15 on 2026-10-19 12:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_started(apps, schema_editor):
+    Job = apps.get_model('jobs', 'Job')
+    Job.objects.filter(status='running').update(heartbeat=F('started'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Воркер отметился'),
+        ),
+        migrations.RunPython(copy_started, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils import timezone
+
+from recipes.constants import MAX_CHAR_LENGTH, MAX_LEN_NAME
+
+User = get_user_model()
+
+
+class Job(models.Model):
+    """ Модель Фоновая задача """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    queue = models.CharField('Очередь', max_length=MAX_LEN_NAME,
+                             default='default')
+    task = models.CharField('Задача', max_length=MAX_CHAR_LENGTH)
+    kwargs = models.JSONField('Аргументы', default=dict, blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True,
+        blank=True,
+        verbose_name='Пользователь',
+    )
+    status = models.CharField('Статус', max_length=MAX_LEN_NAME,
+                              choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Максимум попыток',
+                                                    default=3)
+    result = models.JSONField('Результат', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    run_at = models.DateTimeField('Запустить не раньше',
+                                  default=timezone.now)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    started = models.DateTimeField('Начата', null=True, blank=True)
+    heartbeat = models.DateTimeField('Воркер отметился', null=True,
+                                     blank=True)
+    finished = models.DateTimeField('Завершена', null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=('queue', 'status', 'run_at'),
+                         name='job_queue_status_run_at'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
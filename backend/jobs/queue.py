@@ -0,0 +1,88 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from jobs.models import Job
+
+
+def enqueue(task, queue='default', user=None, **kwargs):
+    """Поставить задачу task (путь к функции) в очередь queue"""
+    return Job.objects.create(task=task, queue=queue, user=user,
+                              kwargs=kwargs)
+
+
+def claim(queue, limit):
+    """
+    Забрать до limit готовых задач очереди. SKIP LOCKED не даёт двум
+    воркерам взять одну и ту же задачу.
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(queue=queue, status=Job.PENDING, run_at__lte=now)
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, started=now,
+            heartbeat=now,
+        )
+    return ids
+
+
+def heartbeat(job_ids):
+    """Отметить, что воркер ещё выполняет задачи job_ids"""
+    return Job.objects.filter(pk__in=job_ids, status=Job.RUNNING).update(
+        heartbeat=timezone.now()
+    )
+
+
+def requeue_stale():
+    """
+    Вернуть в очередь задачи, воркер которых пропал: не отмечался
+    дольше JOB_TIMEOUT секунд. Задача, которая уже исчерпала попытки,
+    считается упавшей: иначе задача, роняющая воркер, возвращалась бы
+    в очередь бесконечно.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat__lt=now - timedelta(seconds=settings.JOB_TIMEOUT),
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished=now,
+        error='Воркер пропал во время выполнения задачи',
+    )
+    return stale.update(status=Job.PENDING)
+
+
+def execute(job_id):
+    """Выполнить задачу в процессе воркера и сохранить результат"""
+    job = Job.objects.get(pk=job_id)
+    try:
+        result = import_string(job.task)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job_id).update(
+                status=Job.PENDING, error=error,
+                run_at=now + timedelta(seconds=delay)
+            )
+        else:
+            Job.objects.filter(pk=job_id).update(
+                status=Job.FAILED, error=error, finished=now
+            )
+        return
+    Job.objects.filter(pk=job_id).update(
+        status=Job.DONE, result=result, error='', finished=timezone.now()
+    )
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import claim, enqueue, execute, heartbeat, requeue_stale
+
+
+def add(a, b):
+    return a + b
+
+
+def fail():
+    raise ValueError('Задача упала')
+
+
+class JobQueueTest(TestCase):
+    """Очередь фоновых задач: постановка, захват, повторы и ошибки"""
+
+    def run_job(self, job):
+        self.assertEqual(claim(job.queue, 1), [job.pk])
+        execute(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_enqueue(self):
+        job = enqueue('jobs.tests.add', queue='exports', a=1, b=2)
+        self.assertEqual((job.queue, job.status, job.kwargs),
+                         ('exports', Job.PENDING, {'a': 1, 'b': 2}))
+
+    def test_claim(self):
+        first = enqueue('jobs.tests.add', a=1, b=2)
+        second = enqueue('jobs.tests.add', a=3, b=4)
+        enqueue('jobs.tests.add', queue='exports', a=5, b=6)
+        Job.objects.create(task='jobs.tests.add',
+                           run_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(claim('default', 0), [])
+        self.assertEqual(claim('default', 1), [first.pk])
+        self.assertEqual(claim('default', 5), [second.pk])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (Job.RUNNING, 1))
+        self.assertIsNotNone(first.heartbeat)
+
+    def test_success(self):
+        job = self.run_job(enqueue('jobs.tests.add', a=1, b=2))
+        self.assertEqual((job.status, job.result), (Job.DONE, 3))
+        self.assertIsNotNone(job.finished)
+
+    def test_retry_backoff(self):
+        job = enqueue('jobs.tests.fail')
+        for attempt in (1, 2):
+            before = timezone.now()
+            job = self.run_job(job)
+            self.assertEqual(job.status, Job.PENDING)
+            self.assertIn('Задача упала', job.error)
+            delay = settings.JOB_RETRY_DELAY * 2 ** (attempt - 1)
+            self.assertGreaterEqual(job.run_at,
+                                    before + timedelta(seconds=delay))
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            job.refresh_from_db()
+
+    def test_failure_after_last_attempt(self):
+        job = enqueue('jobs.tests.fail')
+        Job.objects.filter(pk=job.pk).update(attempts=job.max_attempts - 1)
+        job = self.run_job(job)
+        self.assertEqual((job.status, job.attempts),
+                         (Job.FAILED, job.max_attempts))
+        self.assertIsNotNone(job.finished)
+
+    def test_requeue_stale_by_heartbeat(self):
+        long_ago = timezone.now() - timedelta(
+            seconds=settings.JOB_TIMEOUT * 10
+        )
+        alive = enqueue('jobs.tests.add', a=1, b=2)
+        lost = enqueue('jobs.tests.add', a=3, b=4)
+        exhausted = enqueue('jobs.tests.fail')
+        claim('default', 3)
+        Job.objects.update(started=long_ago, heartbeat=long_ago)
+        Job.objects.filter(pk=exhausted.pk).update(attempts=3)
+        # Долгая задача, воркер которой отмечается, остаётся у него.
+        self.assertEqual(heartbeat([alive.pk]), 1)
+        self.assertEqual(requeue_stale(), 1)
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {alive.pk: Job.RUNNING,
+                                    lost.pk: Job.PENDING,
+                                    exhausted.pk: Job.FAILED})
@@ -1,11 +1,18 @@
 from django import forms
 from django.contrib import admin
 from django.contrib.admin import display
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.html import format_html_join
 
+from jobs.queue import enqueue
 from recipes.constants import MIN_VALUE
+from recipes.duplicates import likely_duplicates
 from .models import (Favorite, Ingredient,
                      IngredientInRecipe, Recipe,
                      ShoppingCart, Tag)
+from .paginators import EstimatedCountPaginator
 
 
 class IngredientsInRecipeInlineFormset(forms.models.BaseInlineFormSet):
@@ -28,41 +35,84 @@ class IngredientInRecipeInline(admin.StackedInline):
     extra = 1
     min_num = MIN_VALUE
     validate_min = True
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без точного COUNT и без запросов на каждую строку"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableAdmin):
     inlines = [IngredientInRecipeInline]
-    list_display = ('name', 'id', 'author')
-    readonly_fields = ('added_in_favorites',)
-    list_filter = ('author', 'name', 'tags',)
-    empty_value_display = '-пусто-'
+    list_display = ('name', 'id', 'author', 'added_in_favorites', 'views')
+    list_select_related = ('author',)
+    readonly_fields = ('added_in_favorites', 'views', 'duplicates')
+    list_filter = ('tags',)
+    search_fields = ('name__startswith', 'author__username__startswith')
+    autocomplete_fields = ('author',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorites_count=Coalesce(Subquery(
+                Favorite.objects.filter(recipe=OuterRef('pk'))
+                .values('recipe')
+                .annotate(count=Count('pk'))
+                .values('count'),
+                output_field=IntegerField()
+            ), 0)
+        )
 
     @display(description='Количество в избранных')
     def added_in_favorites(self, obj):
-        return obj.recipes_favorite_related.count()
+        return obj.favorites_count
+
+    @display(description='Вероятные дубликаты')
+    def duplicates(self, obj):
+        found = likely_duplicates(obj.pk)
+        names = Recipe.objects.in_bulk([pk for pk, _ in found])
+        return format_html_join(
+            ', ', '<a href="{}">{}</a> ({})', (
+                (reverse('admin:recipes_recipe_change', args=[pk]),
+                 names[pk].name, f'{similarity:.0%}')
+                for pk, similarity in found if pk in names
+            )
+        ) or None
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        enqueue('recipes.duplicates.update_signature',
+                recipe_id=form.instance.pk)
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     list_display = ('name', 'measurement_unit',)
-    list_filter = ('name',)
-    empty_value_display = '-пусто-'
+    search_fields = ('name__startswith',)
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    list_display = ('name', 'color', 'slug',)
+    list_display = ('name', 'color', 'slug', 'recipes_count')
+    search_fields = ('name',)
     empty_value_display = '-пусто-'
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe',)
-    empty_value_display = '-пусто-'
+class ShoppingCartAdmin(LargeTableAdmin):
+    list_display = ('user', 'recipe', 'created')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe',)
-    empty_value_display = '-пусто-'
+class FavoriteAdmin(LargeTableAdmin):
+    list_display = ('user', 'recipe', 'created')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
@@ -0,0 +1,147 @@
+import hashlib
+import random
+import re
+import struct
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from recipes.models import (IngredientInRecipe, Recipe, RecipeBucket,
+                            RecipeSignature)
+
+# 64 хеш-функции, 8 полос по 8 значений: кандидатами становятся рецепты
+# со сходством примерно от 0.77, у которых совпала хотя бы одна полоса.
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Хеши вида (a * x + b) mod p с постоянными a и b, одинаковыми
+# во всех процессах.
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+_random = random.Random(20240607)
+COEFFICIENTS = [
+    (_random.randrange(1, PRIME), _random.randrange(0, PRIME))
+    for _ in range(NUM_PERM)
+]
+SIGNATURE_FORMAT = f'<{NUM_PERM}I'
+WORD = re.compile(r'\w+')
+
+
+def shingles(text, ingredient_ids):
+    """Тройки слов описания и ингредиенты рецепта"""
+    words = WORD.findall(text.lower())
+    result = {
+        ' '.join(words[start:start + SHINGLE_WORDS])
+        for start in range(max(len(words) - SHINGLE_WORDS + 1, 1))
+    }
+    result.update(f'ingredient:{pk}' for pk in ingredient_ids)
+    result.discard('')
+    return result
+
+
+def base_hash(shingle):
+    return int.from_bytes(
+        hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little'
+    )
+
+
+def signature(items):
+    """MinHash: минимум каждой из NUM_PERM хеш-функций по множеству"""
+    hashes = [base_hash(item) for item in items]
+    if not hashes:
+        return (MAX_HASH,) * NUM_PERM
+    return tuple(
+        min([(a * value + b) % PRIME for value in hashes]) & MAX_HASH
+        for a, b in COEFFICIENTS
+    )
+
+
+def pack(values):
+    return struct.pack(SIGNATURE_FORMAT, *values)
+
+
+def unpack(data):
+    return struct.unpack(SIGNATURE_FORMAT, bytes(data))
+
+
+def band_keys(values):
+    """Ключ корзины LSH для каждой полосы сигнатуры"""
+    packed = pack(values)
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(
+            bytes([band]) + packed[band * ROWS * 4:(band + 1) * ROWS * 4],
+            digest_size=8,
+        ).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def similarity(first, second):
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def update_signatures(recipe_ids):
+    """Пересчитать сигнатуры и корзины LSH для рецептов recipe_ids"""
+    recipe_ids = list(recipe_ids)
+    texts = dict(Recipe.objects.filter(pk__in=recipe_ids).values_list(
+        'id', 'text'
+    ))
+    ingredients = defaultdict(list)
+    for recipe_id, ingredient_id in IngredientInRecipe.objects.filter(
+        recipe_id__in=texts
+    ).values_list('recipe_id', 'ingredient_id'):
+        ingredients[recipe_id].append(ingredient_id)
+    signatures = []
+    buckets = []
+    for recipe_id, text in texts.items():
+        values = signature(shingles(text, ingredients[recipe_id]))
+        signatures.append(
+            RecipeSignature(recipe_id=recipe_id, signature=pack(values))
+        )
+        buckets.extend(
+            RecipeBucket(recipe_id=recipe_id, key=key)
+            for key in band_keys(values)
+        )
+    with transaction.atomic():
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeBucket.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSignature.objects.bulk_create(signatures)
+        RecipeBucket.objects.bulk_create(buckets)
+    return len(signatures)
+
+
+def update_signature(recipe_id):
+    update_signatures([recipe_id])
+
+
+def likely_duplicates(recipe_id, threshold=None):
+    """
+    Рецепты, похожие на recipe_id: кандидаты из общих корзин LSH,
+    отсортированные по оценке сходства. Список пар (id, сходство).
+    """
+    if threshold is None:
+        threshold = settings.DUPLICATE_THRESHOLD
+    own = RecipeSignature.objects.filter(recipe_id=recipe_id).values_list(
+        'signature', flat=True
+    ).first()
+    if own is None:
+        return []
+    own = unpack(own)
+    candidates = RecipeBucket.objects.filter(
+        key__in=RecipeBucket.objects.filter(
+            recipe_id=recipe_id
+        ).values('key'),
+    ).exclude(recipe_id=recipe_id).values('recipe_id')
+    found = []
+    for candidate, data in RecipeSignature.objects.filter(
+        recipe_id__in=candidates
+    ).values_list('recipe_id', 'signature'):
+        score = similarity(own, unpack(data))
+        if score >= threshold:
+            found.append((candidate, score))
+    found.sort(key=lambda pair: (-pair[1], pair[0]))
+    return found
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from recipes.duplicates import update_signatures
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Посчитать MinHash-сигнатуры рецептов для поиска дубликатов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Сколько рецептов обрабатывать за раз",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересчитать и уже посчитанные сигнатуры",
+        )
+
+    def handle(self, *args, **kwargs):
+        queryset = Recipe.objects.order_by("id")
+        if not kwargs["all"]:
+            queryset = queryset.filter(signature__isnull=True)
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).values_list(
+                "id", flat=True
+            )[:kwargs["batch_size"]])
+            if not ids:
+                break
+            updated += update_signatures(ids)
+            last_id = ids[-1]
+            self.stdout.write(f"Обработано рецептов: {updated}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово, сигнатур посчитано: {updated}"
+        ))
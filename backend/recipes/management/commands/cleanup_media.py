@@ -0,0 +1,151 @@
+import os
+import time
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import FileField
+
+# Каталог в MEDIA_ROOT, куда переносятся неиспользуемые файлы. Удаляются
+# они следующим запуском, если за --min-age на них никто не сослался.
+QUARANTINE_DIR = '.quarantine'
+
+
+def walk_files(path, root, skip=None):
+    """Обойти файлы каталога по одному, не собирая весь список в память"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.path == skip:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path, root, skip)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry, os.path.relpath(entry.path, root).replace(
+                    os.sep, '/'
+                )
+
+
+def file_fields():
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, FileField):
+                yield model, field.name
+
+
+class Command(BaseCommand):
+    help = "Удалить медиафайлы, на которые не ссылается ни одна запись"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Сколько файлов проверять одним запросом",
+        )
+        parser.add_argument(
+            "-a",
+            "--min-age",
+            type=int,
+            default=60 * 60,
+            help="Не трогать файлы моложе стольких секунд",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, что будет удалено",
+        )
+
+    def referenced(self, names):
+        found = set()
+        for model, field_name in file_fields():
+            found.update(model.objects.filter(
+                **{f'{field_name}__in': names}
+            ).values_list(field_name, flat=True))
+        return found
+
+    def clean_batch(self, batch, deadline, dry_run):
+        """
+        Перенести в карантин файлы batch, на которые нет ссылок. Пока шла
+        проверка, файл могли загрузить заново: storage тогда только
+        обновляет время изменения, поэтому оно проверяется ещё раз.
+        """
+        unused = set(batch) - self.referenced(list(batch))
+        moved = 0
+        for name in sorted(unused):
+            path = batch[name]
+            try:
+                if os.stat(path).st_mtime > deadline:
+                    continue
+            except FileNotFoundError:
+                continue
+            moved += 1
+            if dry_run:
+                self.stdout.write(name)
+                continue
+            target = os.path.join(self.quarantine, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Загрузка после переноса не найдёт файл и запишет его заново.
+            os.replace(path, target)
+            os.utime(target)
+        return moved
+
+    def purge_batch(self, batch, deadline, dry_run):
+        """
+        Удалить файлы карантина, пролежавшие там дольше --min-age. Файл,
+        на который снова сослались, возвращается на место.
+        """
+        referenced = self.referenced(list(batch))
+        purged = 0
+        for name, path in sorted(batch.items()):
+            original = os.path.join(default_storage.location, name)
+            if name in referenced and not os.path.exists(original):
+                if not dry_run:
+                    os.replace(path, original)
+            elif os.stat(path).st_mtime <= deadline:
+                purged += 1
+                if dry_run:
+                    self.stdout.write(f'{QUARANTINE_DIR}/{name}')
+                else:
+                    os.remove(path)
+        return purged
+
+    def batches(self, files, size):
+        batch = {}
+        for name, path in files:
+            batch[name] = path
+            if len(batch) >= size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(self.style.WARNING("Начало очистки"))
+        root = default_storage.location
+        if not os.path.isdir(root):
+            self.stdout.write(self.style.SUCCESS("Медиафайлов нет"))
+            return
+        self.quarantine = os.path.join(root, QUARANTINE_DIR)
+        deadline = time.time() - kwargs["min_age"]
+        size, dry_run = kwargs["batch_size"], kwargs["dry_run"]
+        purged = 0
+        if os.path.isdir(self.quarantine):
+            for batch in self.batches((
+                (name, entry.path)
+                for entry, name in walk_files(self.quarantine,
+                                              self.quarantine)
+            ), size):
+                purged += self.purge_batch(batch, deadline, dry_run)
+        checked = moved = 0
+        for batch in self.batches((
+            (name, entry.path)
+            for entry, name in walk_files(root, root, self.quarantine)
+            if entry.stat().st_mtime <= deadline
+        ), size):
+            checked += len(batch)
+            moved += self.clean_batch(batch, deadline, dry_run)
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено файлов: {checked}, не используется: {moved},"
+            f" удалено из карантина: {purged}"
+        ))
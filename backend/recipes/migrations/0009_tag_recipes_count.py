@@ -0,0 +1,33 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipes(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Tag.objects.update(recipes_count=Coalesce(Subquery(
+        Recipe.tags.through.objects.filter(tag_id=OuterRef('pk'))
+        .values('tag_id')
+        .annotate(count=Count('id'))
+        .values('count'),
+        output_field=models.IntegerField()
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_signatures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
 from django.db.models import UniqueConstraint
+from django.utils import timezone
 
 from recipes.constants import MAX_CHAR_LENGTH, MIN_VALUE, MAX_HEX_CHARACTERS
 
@@ -12,7 +13,8 @@ class Ingredient(models.Model):
     """ Модель Ингридиент """
 
     name = models.CharField('Название',
-                            max_length=MAX_CHAR_LENGTH)
+                            max_length=MAX_CHAR_LENGTH,
+                            db_index=True)
     measurement_unit = models.CharField('Единица измерения',
                                         max_length=MAX_CHAR_LENGTH)
 
@@ -49,6 +51,9 @@ class Tag(models.Model):
     )
     slug = models.SlugField('Уникальный слаг', unique=True,
                             max_length=MAX_CHAR_LENGTH)
+    # Ведётся сигналами api.signals при изменении тегов рецептов.
+    recipes_count = models.PositiveIntegerField('Рецептов', default=0,
+                                                editable=False)
 
     class Meta:
         verbose_name = 'Тег'
@@ -61,7 +66,8 @@ class Tag(models.Model):
 class Recipe(models.Model):
     """ Модель Рецепт """
 
-    name = models.CharField('Название', max_length=MAX_CHAR_LENGTH)
+    name = models.CharField('Название', max_length=MAX_CHAR_LENGTH,
+                            db_index=True)
     author = models.ForeignKey(
         User,
         related_name='recipes',
@@ -72,7 +78,8 @@ class Recipe(models.Model):
     text = models.TextField('Описание')
     image = models.ImageField(
         'Изображение',
-        upload_to='recipes/'
+        upload_to='recipes/',
+        db_index=True
     )
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
@@ -92,15 +99,42 @@ class Recipe(models.Model):
         related_name='recipes',
         verbose_name='Теги'
     )
+    views = models.PositiveIntegerField('Просмотры', default=0,
+                                        editable=False)
+    trending = models.FloatField('Популярность', default=0, editable=False)
+    created = models.DateTimeField('Создан', auto_now_add=True)
+    updated = models.DateTimeField('Изменён', auto_now=True, db_index=True)
+
+    # Эти поля прибавляются прямо в базе (api.view_counts, api.trending),
+    # и обычное сохранение не должно затирать их значением из памяти.
+    counter_fields = ('views', 'trending')
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-trending', '-id'],
+                         name='recipe_trending_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, **filters):
+        """Отметить изменение рецептов, подходящих под filters"""
+        cls.objects.filter(**filters).update(updated=timezone.now())
+
 
 class IngredientInRecipe(models.Model):
     """ Модель для связи Ингридиента и Рецепта """
@@ -153,6 +187,8 @@ class UserRecipeDependence(models.Model):
         related_name='%(app_label)s_%(class)s_related',
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField('Добавлено', auto_now_add=True,
+                                   db_index=True)
 
     class Meta:
         abstract = True
@@ -164,6 +200,49 @@ class UserRecipeDependence(models.Model):
         ]
 
 
+class RecipeSignature(models.Model):
+    """ MinHash-сигнатура рецепта для поиска дубликатов """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature',
+        verbose_name='Рецепт',
+    )
+    signature = models.BinaryField('Сигнатура')
+
+    class Meta:
+        verbose_name = 'Сигнатура рецепта'
+        verbose_name_plural = 'Сигнатуры рецептов'
+
+
+class RecipeBucket(models.Model):
+    """ Корзина LSH: рецепты с одинаковой полосой сигнатуры """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='lsh_buckets',
+        verbose_name='Рецепт',
+    )
+    key = models.BigIntegerField('Ключ полосы', db_index=True)
+
+    class Meta:
+        verbose_name = 'Корзина LSH'
+        verbose_name_plural = 'Корзины LSH'
+
+
+class TrendingState(models.Model):
+    """ Докуда учтены события в рейтинге популярных рецептов """
+
+    landmark = models.DateTimeField('Точка отсчёта весов')
+    watermark = models.DateTimeField('События учтены до')
+
+    class Meta:
+        verbose_name = 'Состояние рейтинга популярных'
+
+
 class Favorite(UserRecipeDependence):
     """ Модель Избранное """
 
@@ -0,0 +1,84 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+
+
+def count_version_key(model):
+    return f'count-version:{model._meta.label_lower}'
+
+
+def count_version(model):
+    return cache.get_or_set(count_version_key(model), 1, None)
+
+
+def bump_count_version(model):
+    """Сбросить закешированные оценки количества для модели"""
+    try:
+        cache.incr(count_version_key(model))
+    except ValueError:
+        cache.set(count_version_key(model), 1, None)
+
+
+def planner_estimate(queryset):
+    """
+    Оценка числа строк по статистике планировщика PostgreSQL:
+    reltuples для всей таблицы, иначе Plan Rows из EXPLAIN.
+    На других базах и без статистики возвращает None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)]
+            )
+            row = cursor.fetchone()
+            if row is not None and row[0] >= 0:
+                return row[0]
+            return None
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        return cursor.fetchone()[0][0]['Plan']['Plan Rows']
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Точный COUNT для выборок меньше ESTIMATED_COUNT_THRESHOLD строк.
+    Для больших — оценка планировщика, закешированная для каждого
+    набора фильтров до создания или удаления объектов модели.
+    Общий для API и админки.
+    """
+    count_is_estimated = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        queryset = self.object_list.values('pk')
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.blake2b(
+            f'{sql}{params}'.encode(), digest_size=16
+        ).hexdigest()
+        key = 'count-estimate:{}:{}:{}'.format(
+            queryset.model._meta.label_lower,
+            count_version(queryset.model),
+            digest,
+        )
+        estimate = cache.get(key)
+        if estimate is None:
+            estimate = planner_estimate(queryset)
+            if estimate is None:
+                return queryset.count()
+            cache.set(key, estimate, settings.COUNT_ESTIMATE_TIMEOUT)
+        if estimate < settings.ESTIMATED_COUNT_THRESHOLD:
+            return queryset.count()
+        self.count_is_estimated = True
+        return estimate
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файлы называются по sha256 содержимого, поэтому одинаковые загрузки
+    хранятся одним файлом, а файл по имени никогда не меняется.
+    Неиспользуемые файлы удаляет команда cleanup_media.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest.hexdigest() + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Повторная загрузка продлевает жизнь файла: cleanup_media
+            # смотрит на время изменения и не удалит его как старый.
+            try:
+                os.utime(self.path(name))
+                return name.replace('\\', '/')
+            except FileNotFoundError:
+                # cleanup_media успел перенести файл в карантин.
+                pass
+        return super().save(name, content, max_length)
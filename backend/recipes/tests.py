@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from recipes.management.commands.cleanup_media import (QUARANTINE_DIR,
+                                                       Command)
+
+User = get_user_model()
+
+CONTENT = b'image'
+# Старше --min-age, с которым запускается команда в тестах.
+OLD = 60 * 60
+
+
+class CleanupMediaTest(TestCase):
+    """cleanup_media не теряет файлы, загруженные во время проверки"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.name = default_storage.save('recipes/photo.png',
+                                         ContentFile(CONTENT))
+        self.age(default_storage.path(self.name))
+
+    def age(self, path):
+        past = time.time() - OLD
+        os.utime(path, (past, past))
+
+    def cleanup(self):
+        call_command('cleanup_media', min_age=60, stdout=StringIO())
+
+    def quarantined(self):
+        return os.path.join(default_storage.location, QUARANTINE_DIR,
+                            self.name)
+
+    def test_unused_file_quarantined_then_purged(self):
+        self.cleanup()
+        self.assertFalse(default_storage.exists(self.name))
+        self.assertTrue(os.path.exists(self.quarantined()))
+        self.cleanup()
+        self.assertTrue(os.path.exists(self.quarantined()))
+        self.age(self.quarantined())
+        self.cleanup()
+        self.assertFalse(os.path.exists(self.quarantined()))
+
+    def test_referenced_file_kept(self):
+        User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', avatar=self.name,
+        )
+        self.cleanup()
+        self.assertTrue(default_storage.exists(self.name))
+
+    def test_uploaded_again_during_check(self):
+        referenced = Command.referenced
+
+        def upload_again(command, names):
+            # Та же картинка загружена, пока команда проверяла ссылки.
+            found = referenced(command, names)
+            self.assertEqual(
+                default_storage.save('recipes/new.png',
+                                     ContentFile(CONTENT)),
+                self.name,
+            )
+            return found
+
+        with mock.patch.object(Command, 'referenced', upload_again):
+            self.cleanup()
+        self.assertTrue(default_storage.exists(self.name))
+
+    def test_uploaded_again_after_quarantine(self):
+        self.cleanup()
+        self.assertEqual(
+            default_storage.save('recipes/new.png', ContentFile(CONTENT)),
+            self.name,
+        )
+        self.assertTrue(default_storage.exists(self.name))
+
+    def test_referenced_again_restored(self):
+        self.cleanup()
+        User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', avatar=self.name,
+        )
+        self.age(self.quarantined())
+        self.cleanup()
+        self.assertTrue(default_storage.exists(self.name))
+        self.assertFalse(os.path.exists(self.quarantined()))
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 
-from .models import Subscribe, User
+from recipes.paginators import EstimatedCountPaginator
+from .models import STATS_FIELDS, Subscribe, User
 
 
 @admin.register(User)
@@ -13,13 +14,26 @@ class UserAdmin(UserAdmin):
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
+        'followers_count',
+    )
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('username__startswith', 'email__startswith')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = STATS_FIELDS
+    fieldsets = UserAdmin.fieldsets + (
+        ('Статистика автора', {'fields': STATS_FIELDS}),
     )
-    list_filter = ('email', 'first_name')
 
 
 @admin.register(Subscribe)
 class SubscribeAdmin(admin.ModelAdmin):
     list_display = ('user', 'author',)
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.unregister(Group)
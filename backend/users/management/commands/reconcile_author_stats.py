@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import STATS_FIELDS, Subscribe, User
+
+
+def count_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .values(field)
+        .annotate(count=Count('id'))
+        .values('count'),
+        output_field=IntegerField()
+    ), 0)
+
+
+def actual_stats():
+    """Счётчики автора, посчитанные заново по таблицам"""
+    return {
+        'recipes_count': count_subquery(Recipe.objects.all(), 'author'),
+        'followers_count': count_subquery(Subscribe.objects.all(), 'author'),
+        'favorites_received': count_subquery(
+            Favorite.objects.all(), 'recipe__author'
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = "Сверить счётчики авторов с данными и исправить расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько пользователей исправлять за запрос",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, сколько счётчиков разошлось",
+        )
+
+    def handle(self, *args, **kwargs):
+        stats = actual_stats()
+        drift = Q()
+        for field in STATS_FIELDS:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        ids = list(User.objects.annotate(**{
+            f'actual_{field}': stats[field] for field in STATS_FIELDS
+        }).filter(drift).order_by("id").values_list("id", flat=True))
+        if kwargs["dry_run"]:
+            self.stdout.write(f"Расхождения у пользователей: {len(ids)}")
+            return
+        size = kwargs["batch_size"]
+        for start in range(0, len(ids), size):
+            # Значения считаются заново в самом UPDATE, чтобы не записать
+            # устаревшие, если данные успели измениться.
+            User.objects.filter(pk__in=ids[start:start + size]).update(
+                **stats
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово, исправлены счётчики пользователей: {len(ids)}"
+        ))
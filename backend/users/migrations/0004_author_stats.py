@@ -0,0 +1,68 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .values(field)
+        .annotate(count=Count('id'))
+        .values('count'),
+        output_field=models.IntegerField()
+    ), 0)
+
+
+def count_stats(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    User.objects.update(
+        recipes_count=count_subquery(Recipe.objects.all(), 'author'),
+        followers_count=count_subquery(Subscribe.objects.all(), 'author'),
+        favorites_received=count_subquery(
+            Favorite.objects.all(), 'recipe__author'
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_tag_recipes_count'),
+        ('users', '0003_shopping_cart_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='favorites_received',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецепты в избранном у других'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-recipes_count', 'id'], name='user_recipes_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-followers_count', 'id'], name='user_followers_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-favorites_received', 'id'], name='user_favorites_received_idx'),
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
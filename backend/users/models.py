@@ -5,6 +5,12 @@ from django.db.models import UniqueConstraint
 
 from recipes.constants import MAX_CHAR_LENGTH
 
+# Счётчики автора, которые можно запросить в профиле (?with_stats=1)
+# и по которым сортируются подписки (?ordering=...).
+STATS_FIELDS = ('recipes_count', 'followers_count', 'favorites_received')
+# Поля автора, которые видны в страницах рецептов.
+PAGE_FIELDS = ('email', 'username', 'first_name', 'last_name', 'avatar')
+
 
 class User(AbstractUser):
     USERNAME_FIELD = 'email'
@@ -22,16 +28,93 @@ class User(AbstractUser):
         'Фотография профиля',
         null=True,
         blank=True,
-        upload_to='avatar/')
+        upload_to='avatar/',
+        db_index=True)
+    shopping_cart_version = models.PositiveIntegerField(
+        'Версия корзины покупок',
+        default=0,
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков',
+        default=0,
+        editable=False,
+    )
+    favorites_received = models.PositiveIntegerField(
+        'Рецепты в избранном у других',
+        default=0,
+        editable=False,
+    )
+
+    # Меняются только через update(), save() их не перезаписывает.
+    counter_fields = ('shopping_cart_version',) + STATS_FIELDS
 
     class Meta:
         ordering = ['id']
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            models.Index(fields=['-recipes_count', 'id'],
+                         name='user_recipes_count_idx'),
+            models.Index(fields=['-followers_count', 'id'],
+                         name='user_followers_count_idx'),
+            models.Index(fields=['-favorites_received', 'id'],
+                         name='user_favorites_received_idx'),
+        ]
 
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_page_values = instance.page_values()
+        return instance
+
+    def page_values(self):
+        deferred = self.get_deferred_fields()
+        return {
+            name: self._meta.get_field(name).get_prep_value(
+                getattr(self, name)
+            )
+            for name in PAGE_FIELDS if name not in deferred
+        }
+
+    def page_fields_changed(self):
+        """Изменились ли с загрузки из базы поля из страниц рецептов"""
+        loaded = getattr(self, 'loaded_page_values', None)
+        return loaded is None or self.page_values() != loaded
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+        self.loaded_page_values = self.page_values()
+
+    @classmethod
+    def bump_shopping_cart_versions(cls, **filters):
+        """Сменить версию корзины у пользователей, подходящих под filters"""
+        cls.objects.filter(**filters).update(
+            shopping_cart_version=models.F('shopping_cart_version') + 1
+        )
+
+    @classmethod
+    def change_stats(cls, field, delta, **filters):
+        """Прибавить delta к счётчику field у пользователей из filters"""
+        queryset = cls.objects.filter(**filters)
+        if delta < 0:
+            # Счётчик, который уже разошёлся с данными, не уходит в минус.
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        queryset.update(**{field: models.F(field) + delta})
+
 
 class Subscribe(models.Model):
     user = models.ForeignKey(